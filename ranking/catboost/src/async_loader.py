@@ -0,0 +1,60 @@
+import logging
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.sql import column, insert, table
+
+
+async def read_sql_async(
+        engine: AsyncEngine,
+        query: str,
+        dtype: dict[str, str] | None = None,
+) -> pd.DataFrame:
+    """
+    pd.read_sql on a pooled async connection: while this query waits for the network
+    the event loop serves other queries and decoding of already received results
+    """
+    async with engine.connect() as connection:
+        frame = await connection.run_sync(
+            lambda sync_connection: pd.read_sql(text(query), sync_connection, dtype=dtype),
+        )
+    logging.info('async select done: %r rows', len(frame))
+    return frame
+
+
+async def write_scores_async(
+        engine: AsyncEngine,
+        table_name: str,
+        ids: np.ndarray,
+        predicts: np.ndarray,
+        scores: np.ndarray,
+        chunk_size: int = 10000,
+):
+    """
+    recreate `table_name (id, predict, score)` and fill it with model results
+    """
+    scores_table = table(table_name, column('id'), column('predict'), column('score'))
+    async with engine.begin() as connection:
+        await connection.execute(text(f"DROP TABLE if exists {table_name};"))
+        await connection.execute(text(
+            f"""
+                CREATE TABLE {table_name} (
+                    id int primary key,
+                    predict bool,
+                    score float
+                );
+            """
+        ))
+        for start in range(0, len(ids), chunk_size):
+            rows = [
+                {'id': id_value, 'predict': predict_value, 'score': score_value}
+                for id_value, predict_value, score_value in zip(
+                    ids[start:start + chunk_size].tolist(),
+                    predicts[start:start + chunk_size].tolist(),
+                    scores[start:start + chunk_size].tolist(),
+                )
+            ]
+            await connection.execute(insert(scores_table), rows)
+    logging.info('saved to %s finished', table_name)
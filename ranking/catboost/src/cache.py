@@ -0,0 +1,81 @@
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import Engine, text
+
+PREPARED_META_KEY = b'prepared_result'
+
+
+def table_fingerprint(engine: Engine, tables: list[str]) -> list[list]:
+    """
+    cheap change marker of source tables: rows count and max id of each one
+    """
+    result = []
+    with engine.connect() as connection:
+        for table in tables:
+            rows_count, max_id = connection.execute(text(f'select count(*), max(id) from {table}')).one()
+            result.append([table, rows_count, max_id])
+    return result
+
+
+class FeatureCache:
+    """
+    Local content addressed store of prepared feature sets as Parquet files.
+
+    Entry key is a hash of everything the data depends on: query, query parameters,
+    source tables fingerprint and the flow code. Least recently used entries are evicted
+    when the directory grows over max_size_bytes.
+    """
+
+    def __init__(self, cache_dir: str | Path = 'feature_cache', max_size_bytes: int = 10 * 2 ** 30):
+        self.cache_dir = Path(cache_dir)
+        self.max_size_bytes = max_size_bytes
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def make_key(**parts) -> str:
+        return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+    def path(self, key: str) -> Path:
+        return self.cache_dir / f'{key}.parquet'
+
+    def load(self, key: str) -> tuple[pd.DataFrame, dict] | None:
+        """
+        :return: cached frame and its metadata or None on cache miss
+        """
+        path = self.path(key)
+        if not path.exists():
+            return None
+        table = pq.read_table(path)
+        os.utime(path)  # mark as recently used
+        meta = json.loads((table.schema.metadata or {}).get(PREPARED_META_KEY, b'{}'))
+        logging.info('Feature cache hit %s', key[:12])
+        return table.to_pandas(), meta
+
+    def save(self, key: str, frame: pd.DataFrame, meta: dict):
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        table = table.replace_schema_metadata({
+            **(table.schema.metadata or {}),
+            PREPARED_META_KEY: json.dumps(meta).encode(),
+        })
+        path = self.path(key)
+        tmp_path = path.with_suffix('.tmp')
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, path)
+        logging.info('Feature cache saved %s: %.1f MB', key[:12], path.stat().st_size / 2 ** 20)
+        self.evict()
+
+    def evict(self):
+        entries = sorted(self.cache_dir.glob('*.parquet'), key=lambda entry: entry.stat().st_mtime, reverse=True)
+        total = 0
+        for pos, entry in enumerate(entries):
+            total += entry.stat().st_size
+            if total > self.max_size_bytes and pos > 0:
+                logging.info('Feature cache evict %s', entry.name)
+                entry.unlink()
@@ -0,0 +1,103 @@
+import logging
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import infer_dtype, is_bool_dtype, is_numeric_dtype
+
+
+def _compact_integer(column: pd.Series) -> pd.Series:
+    info = np.iinfo(np.int32)
+    if len(column) == 0 or (info.min <= column.min() and column.max() <= info.max):
+        return column.astype(np.int32)
+    return column
+
+
+def compact_column(column: pd.Series, categorical: bool = False) -> pd.Series:
+    """
+    smallest lossless-enough dtype for a loaded column:
+    categorical -> dictionary encoded category, bools -> nullable boolean (values + mask),
+    Decimal / floats -> float32, integers -> int32 when they fit, other strings -> category
+    """
+    if categorical:
+        return column.astype('category')
+    if is_bool_dtype(column.dtype):
+        return column.astype('boolean')
+    if is_numeric_dtype(column.dtype):
+        if pd.api.types.is_integer_dtype(column.dtype):
+            return _compact_integer(column)
+        return column.astype(np.float32)
+
+    inferred = infer_dtype(column, skipna=True)
+    if inferred == 'boolean':
+        return column.astype('boolean')
+    if inferred in ('decimal', 'floating', 'mixed-integer-float', 'integer'):
+        return pd.to_numeric(column).astype(np.float32)
+    if inferred in ('string', 'empty'):
+        return column.astype('category')
+    return column
+
+
+def untyped_columns(data: pd.DataFrame, allowed: list[str]) -> list[str]:
+    """
+    object dtype columns (python Decimal, bool with nulls, ...) except allowed ones
+    """
+    return [name for name, dtype in data.dtypes.items() if dtype == object and name not in allowed]
+
+
+def compact_frame(
+        data: pd.DataFrame,
+        categorical_columns: list[str],
+        keep_columns: list[str] | None = None,
+) -> pd.DataFrame:
+    """
+    :param data: frame as read by pd.read_sql
+    :param categorical_columns: columns to dictionary encode
+    :param keep_columns: columns to leave as loaded (e.g. targets with label semantics)
+    """
+    keep_columns = keep_columns or []
+    before = data.memory_usage(deep=True).sum()
+    result = pd.DataFrame(
+        {
+            name: (
+                column if name in keep_columns
+                else compact_column(column, categorical=name in categorical_columns)
+            )
+            for name, column in data.items()
+        },
+        index=data.index,
+    )
+    logging.info(
+        'Data compacted %.1f MB -> %.1f MB',
+        before / 2 ** 20,
+        result.memory_usage(deep=True).sum() / 2 ** 20,
+    )
+    return result
+
+
+def feature_matrix(data: pd.DataFrame, columns: list[str]) -> np.ndarray:
+    """
+    C-contiguous float32 matrix of numeric and bool columns, nulls as NaN
+    """
+    matrix = np.empty((len(data), len(columns)), dtype=np.float32)
+    for pos, name in enumerate(columns):
+        matrix[:, pos] = data[name].to_numpy(dtype=np.float32, na_value=np.nan)
+    return matrix
+
+
+def features_frame(
+        data: pd.DataFrame,
+        columns: list[str],
+        categorical_columns: list[str],
+        matrix: np.ndarray,
+) -> pd.DataFrame:
+    """
+    features frame in the requested columns order backed by the float32 `matrix`
+    of not categorical features (no copy) plus categorical columns of data
+    """
+    numeric_columns = [name for name in columns if name not in categorical_columns]
+    assert matrix.shape == (len(data), len(numeric_columns))
+    frame = pd.DataFrame(matrix, columns=numeric_columns, index=data.index, copy=False)
+    for pos, name in enumerate(columns):
+        if name in categorical_columns:
+            frame.insert(pos, name, data[name])
+    return frame
@@ -0,0 +1,209 @@
+import logging
+import multiprocessing
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from catboost import CatBoostRanker, Pool
+
+from ranking.catboost.src.compact import features_frame
+from ranking.catboost.src.groups import RequestGroups
+from ranking.catboost.src.labels import flag_mask
+from ranking.catboost.src.lib import AbstractTrainFlow, PreparedResult
+from ranking.catboost.src.metrics import LABEL_PREFIXES, ranking_metrics
+from ranking.catboost.src.sweep import split_threads
+
+
+def request_folds(groups: RequestGroups, folds: int = 5, random_state: int | None = 41) -> np.ndarray:
+    """
+    fold of every request: requests are shuffled and dealt to folds, fold sizes differ by one request at most
+    """
+    folds_of_groups = np.empty(groups.groups_count, dtype=np.int64)
+    folds_of_groups[np.random.default_rng(random_state).permutation(groups.groups_count)] = (
+        np.arange(groups.groups_count) % folds
+    )
+    return folds_of_groups
+
+
+def _categories(column: pd.Series) -> tuple[np.ndarray, list]:
+    """
+    codes and categories of a text feature, pd.Categorical.from_codes gives its values back
+    """
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return np.asarray(column.cat.codes, dtype=np.int32), list(column.cat.categories)
+    codes, categories = pd.factorize(column)
+    return np.asarray(codes, dtype=np.int32), list(categories)
+
+
+def save_shared(prepared_data: PreparedResult, flow: AbstractTrainFlow, row_folds: np.ndarray, path: Path) -> dict:
+    """
+    arrays of prepared data for fold workers as .npy files with rows ordered by fold (every fold is
+    a contiguous block, rows of a request stay contiguous), opened memory mapped by every worker:
+    float32 matrix of numeric features, codes of text features, label, group codes, sent rows of labels, pairs
+
+    :return: description of saved arrays for workers: fold bounds, categories of text features
+    """
+    params = flow.learn_pool_params()
+    text_features = prepared_data.text_features
+    order = np.argsort(row_folds, kind='stable')
+    categories = {}
+    codes = []
+    for column in text_features:
+        column_codes, categories[column] = _categories(prepared_data.data[column])
+        codes.append(column_codes)
+    arrays = {
+        'features': prepared_data.feature_matrix[order],
+        'cat_codes': np.column_stack(codes or [np.zeros(len(order), dtype=np.int32)])[order],
+        'label': prepared_data.label_values(params['label_column'])[order],
+        'group_codes': prepared_data.groups.codes[order],
+        'sent': np.column_stack(
+            [flag_mask(prepared_data.data[label], True) for label in LABEL_PREFIXES if label in prepared_data.data]
+            or [np.zeros(len(order), dtype=bool)]
+        )[order],
+    }
+    if params['pairs'] is not None:
+        positions = np.empty(len(order), dtype=np.int64)
+        positions[order] = np.arange(len(order))
+        arrays['pairs'] = positions[prepared_data.make_pairs(**params['pairs'])]
+    for name, values in arrays.items():
+        np.save(path / f'{name}.npy', np.ascontiguousarray(values))
+    return {
+        'path': str(path),
+        'bounds': np.searchsorted(row_folds[order], np.arange(row_folds.max() + 2)).tolist(),
+        'text_features': text_features,
+        'categories': categories,
+        'features_columns': prepared_data.features_columns,
+        'labels': [label for label in LABEL_PREFIXES if label in prepared_data.data],
+        'has_pairs': params['pairs'] is not None,
+    }
+
+
+def _fold_frame(shared: dict, matrix: np.ndarray, cat_codes: np.ndarray) -> pd.DataFrame:
+    """
+    features frame of rows as learn() gets it (compact.features_frame): float32 block over matrix,
+    text features with their values
+    """
+    cat_data = pd.DataFrame({
+        column: pd.Categorical.from_codes(cat_codes[:, pos], shared['categories'][column])
+        for pos, column in enumerate(shared['text_features'])
+    }, index=pd.RangeIndex(len(matrix)))
+    return features_frame(cat_data, shared['features_columns'], shared['text_features'], matrix)
+
+
+def _fit_fold(fold: int, shared: dict, model_class: type, params: dict) -> dict:
+    """
+    learn on all folds but one and score it, in a worker process over memory mapped arrays:
+    test rows are read from the map as they are, train rows (the blocks before and after the fold)
+    are copied once into one array, CatBoost takes one array per pool
+    """
+    started = time.perf_counter()
+    arrays = {
+        path.stem: np.load(path, mmap_mode='r')
+        for path in Path(shared['path']).glob('*.npy')
+    }
+    start, end = shared['bounds'][fold], shared['bounds'][fold + 1]
+
+    def train_rows(name: str) -> np.ndarray:
+        return np.concatenate([arrays[name][:start], arrays[name][end:]])
+
+    pairs = None
+    if shared['has_pairs']:
+        all_pairs = np.asarray(arrays['pairs'])
+        # requests are not split between folds, so are pairs: the winner fold is the pair fold
+        winners = all_pairs[:, 0]
+        pairs = all_pairs[(winners < start) | (winners >= end)]
+        pairs = np.where(pairs >= end, pairs - (end - start), pairs)
+    pool = Pool(
+        _fold_frame(shared, train_rows('features'), train_rows('cat_codes')),
+        label=train_rows('label'),
+        pairs=pairs,
+        cat_features=shared['text_features'],
+        group_id=train_rows('group_codes'),
+    )
+    loaded = time.perf_counter()
+    model = model_class(**params)
+    model.fit(pool)
+    fitted = time.perf_counter()
+    scores = model.predict(_fold_frame(shared, arrays['features'][start:end], arrays['cat_codes'][start:end]))
+    groups = RequestGroups(np.asarray(arrays['group_codes'][start:end]))
+    labels = {label: np.asarray(arrays['sent'][start:end, pos]) for pos, label in enumerate(shared['labels'])}
+    return {
+        'fold': fold,
+        'train_rows': len(arrays['label']) - (end - start),
+        'test_rows': end - start,
+        'pairs': 0 if pairs is None else len(pairs),
+        **ranking_metrics(groups, scores, labels),
+        'load_seconds': loaded - started,
+        'fit_seconds': fitted - loaded,
+        'predict_seconds': time.perf_counter() - fitted,
+        'scores': scores,
+    }
+
+
+def cross_validate(
+        flow: AbstractTrainFlow,
+        prepared_data: PreparedResult,
+        folds: int = 5,
+        model_class: type = CatBoostRanker,
+        params: dict | None = None,
+        workers: int | None = None,
+        random_state: int | None = 41,
+        work_dir: str | Path | None = None,
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    K-fold cross validation by requestid with folds learned in parallel processes
+
+    Prepared data is saved once as .npy arrays ordered by fold and memory mapped read only by all workers,
+    text features go to CatBoost with their values as in learn(); cores are split between concurrent folds
+    by thread_count. Memory of a worker: its train rows copied once from the map ((folds - 1) / folds
+    of the float32 matrix) and the CatBoost pool of them; test rows are not copied.
+
+    :param flow: gives label and pairs of the learn pool (learn_pool_params)
+    :param params: model params, thread_count is set by the runner
+    :param work_dir: directory for shared arrays (temporary, removed after the run)
+    :return: per fold metrics and timings; summary: mean and std of fold metrics
+        and out of fold metrics of all requests (every request scored by the model that did not see it)
+    """
+    assert prepared_data.groups.groups_count >= folds, 'fewer requests than folds'
+    started = time.perf_counter()
+    row_folds = prepared_data.groups.broadcast(request_folds(prepared_data.groups, folds, random_state))
+    shared_path = Path(tempfile.mkdtemp(prefix='cv_', dir=work_dir))
+    try:
+        shared = save_shared(prepared_data, flow, row_folds, shared_path)
+        saved = time.perf_counter()
+        workers, thread_count = split_threads(folds, workers)
+        logging.info('Cross validation of %r folds: %r concurrent, %r threads each', folds, workers, thread_count)
+        model_params = {'verbose': False, **(params or {}), 'thread_count': thread_count}
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            results = list(executor.map(
+                _fit_fold,
+                range(folds),
+                [shared] * folds,
+                [model_class] * folds,
+                [model_params] * folds,
+            ))
+    finally:
+        shutil.rmtree(shared_path, ignore_errors=True)
+
+    out_of_fold = np.empty(len(prepared_data.data), dtype=np.float64)
+    for result in results:
+        # scores are in fold order, rows of the fold in data order
+        out_of_fold[np.flatnonzero(row_folds == result['fold'])] = result.pop('scores')
+    fold_table = pd.DataFrame(results)
+    metric_columns = [
+        column for column in fold_table.columns
+        if column not in ('fold', 'train_rows', 'test_rows', 'pairs')
+    ]
+    summary = pd.DataFrame({
+        'mean': fold_table[metric_columns].mean(),
+        'std': fold_table[metric_columns].std(),
+    })
+    summary['out_of_fold'] = pd.Series(prepared_data.ranking_metrics(out_of_fold))
+    summary.loc['save_seconds', 'out_of_fold'] = saved - started
+    summary.loc['wall_seconds', 'out_of_fold'] = time.perf_counter() - started
+    logging.info('Cross validation done in %.1f s', summary.loc['wall_seconds', 'out_of_fold'])
+    return fold_table, summary
@@ -0,0 +1,78 @@
+import logging
+import time
+
+import pandas as pd
+from catboost import CatBoost, Pool
+
+from ranking.catboost.src.lib import AbstractTrainFlow, PreparedResult
+
+
+def tree_prefixes(tree_count: int, step: int) -> list[int]:
+    """
+    tree counts staged_predict yields with eval_period=step: every step trees and the whole model
+    """
+    return list(range(step, tree_count, step)) + [tree_count]
+
+
+def prefix_latency(model, data: pd.DataFrame, tree_count: int, repeats: int = 3) -> float:
+    """
+    seconds per row of predict on raw features by the first tree_count trees, best of repeats
+    """
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        model.predict(data, ntree_end=tree_count)
+        timings.append(time.perf_counter() - started)
+    return min(timings) / max(len(data), 1)
+
+
+def iteration_curve(
+        model,
+        test: PreparedResult,
+        step: int = 100,
+        latency_rows: int | None = 10000,
+) -> pd.DataFrame:
+    """
+    post-processing metrics of the model cut to every step trees, from one staged prediction pass:
+    scores of a prefix are the previous ones plus the next step trees
+
+    :param latency_rows: test rows to time predict of each prefix on, None to skip latency
+    :return: one row per prefix: trees, ranking_metrics of test, latency_us (predict time per row)
+    """
+    pool = Pool(test.features_frame, cat_features=test.text_features)
+    latency_data = None if latency_rows is None else test.features_frame.iloc[:latency_rows]
+    rows = []
+    # raw scores for rankers and classifiers alike: their staged_predict gives no choice or class labels
+    stages = CatBoost.staged_predict(model, pool, prediction_type='RawFormulaVal', eval_period=step)
+    for trees, scores in zip(tree_prefixes(model.tree_count_, step), stages):
+        row = {'trees': trees, **test.ranking_metrics(scores)}
+        if latency_data is not None:
+            row['latency_us'] = prefix_latency(model, latency_data, trees) * 1e6
+        rows.append(row)
+    curve = pd.DataFrame(rows)
+    logging.info('Iteration curve of %r prefixes', len(curve))
+    return curve
+
+
+def learn_curve(
+        flow: AbstractTrainFlow,
+        train: PreparedResult,
+        test: PreparedResult,
+        step: int = 100,
+        latency_rows: int | None = 10000,
+) -> pd.DataFrame:
+    """
+    learn the flow model once (with its largest iterations count) and evaluate all its tree prefixes,
+    instead of learning a model for every iterations count
+
+    :return: iteration_curve with learn_seconds of the whole model
+    """
+    started = time.perf_counter()
+    flow.learn(train)
+    learn_seconds = time.perf_counter() - started
+    curve = iteration_curve(flow.model, test, step, latency_rows)
+    curve['learn_seconds'] = learn_seconds
+    metric = next((column for column in ['f_rank_score', 'rank_score'] if column in curve.columns), None)
+    if metric is not None:
+        logging.info('Best prefix by %s: %r trees', metric, int(curve.loc[curve[metric].idxmin(), 'trees']))
+    return curve
@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+
+# options with the same values of these columns are the same option sold with different prices
+SAME_OPTION_COLUMNS = [
+    'requestid',
+    'requestdate',
+    'clientid',
+    'travellergrade',
+    'searchroute',
+    'requestdeparturedate',
+    'requestreturndate',
+    'fligtoption',
+    'departuredate',
+    'arrivaldate',
+    'returndepatruredate',
+    'returnarrivaldate',
+    'segmentcount',
+    'class',
+    'isbaggage',
+    'isrefundpermitted',
+    'isexchangepermitted',
+]
+
+
+def _normalized(column: pd.Series) -> pd.Series:
+    """
+    the same values in one dtype whatever dtype they are stored in (Int64 or float64, object or category):
+    numbers and flags as float64, dates as int64 nanoseconds, other values as strings; nulls as NaN or None
+    """
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        column = column.astype(object)
+    kind = pd.api.types.infer_dtype(column, skipna=True)
+    if kind == 'empty':
+        return pd.Series(np.full(len(column), np.nan))
+    if kind in ('integer', 'floating', 'mixed-integer-float', 'decimal', 'boolean'):
+        return pd.Series(column.to_numpy(dtype=np.float64, na_value=np.nan))
+    if kind in ('datetime64', 'datetime', 'date'):
+        return pd.Series(pd.to_datetime(column).to_numpy(dtype='datetime64[ns]').view(np.int64))
+    return pd.Series(np.where(column.notna().to_numpy(), column.astype(str).to_numpy(), None), dtype=object)
+
+
+def option_class_keys(data: pd.DataFrame, columns: list[str] | None = None) -> np.ndarray:
+    """
+    64-bit hash of the identity tuple of every row, nulls are equal as in GROUP BY;
+    values are hashed normalized, so the same tuple gets the same key whatever dtypes a build reads,
+    keys are stable between builds
+
+    :return: int64 keys (bigint in db)
+    """
+    columns = columns or SAME_OPTION_COLUMNS
+    normalized = pd.DataFrame({column: _normalized(data[column]) for column in columns})
+    return pd.util.hash_pandas_object(normalized, index=False).to_numpy().view(np.int64)
+
+
+def class_min(class_keys: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """
+    min of values over the rows of the same class ignoring NaN, for every row
+    """
+    codes, uniques = pd.factorize(class_keys)
+    order = np.argsort(codes, kind='stable')
+    sizes = np.bincount(codes, minlength=len(uniques))
+    starts = np.zeros(len(uniques), dtype=np.int64)
+    np.cumsum(sizes[:-1], out=starts[1:])
+    if len(uniques) == 0:
+        return np.empty(0, dtype=np.float64)
+    minimums = np.fmin.reduceat(np.asarray(values, dtype=np.float64)[order], starts)
+    return minimums[codes]
+
+
+def same_option_classes(data: pd.DataFrame, price_column: str = 'amount') -> tuple[np.ndarray, np.ndarray]:
+    """
+    equivalence classes of options and their cheapest members
+
+    :return: class key of every row, flags of rows with the lowest price of their class (same_options_best_price)
+    """
+    class_keys = option_class_keys(data)
+    prices = data[price_column].to_numpy(dtype=np.float64, na_value=np.nan)
+    return class_keys, prices == class_min(class_keys, prices)
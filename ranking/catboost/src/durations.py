@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+
+from ranking.catboost.src.group_kernels import group_min
+from ranking.catboost.src.groups import RequestGroups
+
+NAT = np.iinfo(np.int64).min
+HOUR = 3600
+
+
+def epoch_seconds(column: pd.Series) -> np.ndarray:
+    """
+    local timestamps as int64 seconds since epoch, NAT for nulls
+    """
+    return pd.to_datetime(column).to_numpy(dtype='datetime64[s]').view(np.int64)
+
+
+def span(end: np.ndarray, start: np.ndarray) -> np.ndarray:
+    """
+    end - start in seconds, NaN when any of them is null
+    """
+    missing = (end == NAT) | (start == NAT)
+    return np.where(missing, np.nan, (end - start).astype(np.float64))
+
+
+def _nullif_zero(values: np.ndarray) -> np.ndarray:
+    return np.where(values == 0, np.nan, values)
+
+
+def trip_durations(
+        departure: np.ndarray,
+        arrival: np.ndarray,
+        return_departure: np.ndarray,
+        return_arrival: np.ndarray,
+        from_timezone: np.ndarray,
+        to_timezone: np.ndarray,
+        return_timezone: np.ndarray,
+) -> dict[str, np.ndarray]:
+    """
+    option durations in seconds from local times (epoch_seconds) and city timezones in hours
+
+    Names and sign conventions are those of the features the models were trained on:
+    *_abs are UTC corrected, total_flight_time_abs is their sum for round trips and to_time_abs for one way ones.
+    total_flight_time keeps the opposite timezone sign of the feature migrations,
+    duration_rank_key is the return part of it (the order of duration_rank).
+
+    :return: to_time, to_time_abs, return_time, return_time_abs, total_flight_time, total_flight_time_abs,
+        duration_rank_key; NaN for nulls
+    """
+    to_time = span(arrival, departure)
+    return_time = span(return_arrival, return_departure)
+    return_time_or_zero = np.nan_to_num(return_time, nan=0)
+    # one way trips end in the to city
+    end_timezone = np.where(np.isnan(return_timezone), to_timezone, return_timezone)
+    trip_shift = (from_timezone - end_timezone) * HOUR
+    return {
+        'to_time': to_time,
+        'to_time_abs': to_time - (to_timezone - from_timezone) * HOUR,
+        'return_time': return_time,
+        'return_time_abs': return_time + (to_timezone - return_timezone) * HOUR,
+        'total_flight_time': to_time + return_time_or_zero - trip_shift,
+        'total_flight_time_abs': to_time + return_time_or_zero + trip_shift,
+        'duration_rank_key': return_time_or_zero - trip_shift,
+    }
+
+
+def request_duration_features(
+        groups: RequestGroups,
+        durations: dict[str, np.ndarray],
+        from_timezone: np.ndarray,
+        to_timezone: np.ndarray,
+        return_timezone: np.ndarray,
+) -> dict[str, np.ndarray]:
+    """
+    per request minimums (rounded as stored in int columns) and ratios of option durations to them
+
+    :param durations: result of trip_durations for rows of groups
+    :return: request grain min_to_time, min_return_time, min_total_flight_time
+        and option grain to_time_abs_ratio, return_time_abs_ratio, total_flight_ratio
+    """
+    min_to_time = np.rint(group_min(groups, durations['to_time']))
+    min_return_time = np.rint(group_min(groups, durations['return_time']))
+    min_total_flight_time = np.rint(group_min(groups, durations['total_flight_time_abs']))
+    return {
+        'min_to_time': min_to_time,
+        'min_return_time': min_return_time,
+        'min_total_flight_time': min_total_flight_time,
+        # the best option time of the request moved to the option timezones
+        'to_time_abs_ratio': (
+            (groups.broadcast(min_to_time) - (to_timezone - from_timezone) * HOUR)
+            / _nullif_zero(durations['to_time_abs'])
+        ),
+        'return_time_abs_ratio': (
+            (groups.broadcast(min_return_time) + (to_timezone - return_timezone) * HOUR)
+            / _nullif_zero(durations['return_time_abs'])
+        ),
+        'total_flight_ratio': (
+            durations['total_flight_time_abs'] / _nullif_zero(groups.broadcast(min_total_flight_time))
+        ),
+    }
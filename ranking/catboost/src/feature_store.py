@@ -0,0 +1,224 @@
+import hashlib
+import inspect
+import json
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from ranking.catboost.src.features import FEATURES, compute_columns
+from ranking.catboost.src.locations import LocationResolver
+
+NULL_DATE_PARTITION = 'no_date'
+
+
+def frame_hash(frame: pd.DataFrame) -> str:
+    """
+    content hash of a frame: column names, dtypes and values
+    """
+    digest = hashlib.sha256(json.dumps([[column, str(dtype)] for column, dtype in frame.dtypes.items()]).encode())
+    if len(frame.columns):
+        digest.update(pd.util.hash_pandas_object(frame, index=True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def request_date_partitions(raw: pd.DataFrame, date_format: str = '%Y-%m') -> pd.Series:
+    """
+    partition of every row: date of its request (the first requestdate of requestid) formatted with date_format,
+    whole requests are in one partition
+    """
+    request_date = raw.groupby('requestid', sort=False)['requestdate'].transform('min')
+    return request_date.dt.strftime(date_format).fillna(NULL_DATE_PARTITION)
+
+
+def read_frame(path: Path) -> pd.DataFrame:
+    """
+    parquet file as pandas frame, string columns saved from object ones are object again (as read_sql gives them)
+    """
+    table = pq.read_table(path)
+    frame = table.to_pandas()
+    object_columns = [
+        column['name'] for column in table.schema.pandas_metadata['columns']
+        if column['numpy_type'] == 'object' and column['name'] in frame.columns
+    ]
+    return frame.astype({column: object for column in object_columns})
+
+
+def _kernel_source(kernel) -> str:
+    try:
+        source = inspect.getsource(kernel)
+    except (OSError, TypeError):
+        source = f'{kernel.__module__}.{kernel.__qualname__}'
+    # loop declared lambdas share the source and differ by defaults
+    return source + repr(getattr(kernel, '__defaults__', None))
+
+
+def definition_hash(column: str, table_prefix: str, locations_key: str, as_is: bool = False) -> str:
+    """
+    hash of everything a column value depends on besides raw rows: kernels of the feature
+    and of all its dependencies, table prefix and locations reference
+    """
+    parts = [column, table_prefix, locations_key]
+    if column in FEATURES and not as_is:
+        for name in FEATURES.plan([column]):
+            feature = FEATURES[name]
+            parts.append([name, feature.inputs, feature.grain, _kernel_source(feature.kernel)])
+    return hashlib.sha256(json.dumps(parts).encode()).hexdigest()
+
+
+def _write_atomic(table: pa.Table, path: Path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + f'.{os.getpid()}.tmp')
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, path)
+
+
+class FeatureStore:
+    """
+    Versioned columnar store of option features, all files are immutable.
+
+    A version freezes raw rows (partitioned by request date) and a locations reference,
+    and names its columns by definition hashes. Files are content addressed:
+        raw/{partition hash}.parquet - raw rows of one request date partition
+        reference/{hash}.parquet - locations
+        columns/{definition hash}/{partition hash}.parquet - one column of one partition
+        versions/{version}.json - manifest
+    so versions share files of unchanged columns and partitions. Column files are computed on first read.
+    """
+
+    def __init__(self, store_dir: str | Path = 'feature_store', date_format: str = '%Y-%m'):
+        """
+        :param date_format: request date format of partition names: monthly by default, '%Y-%m-%d' for days
+        """
+        self.store_dir = Path(store_dir)
+        self.date_format: str = date_format
+        for subdir in ['raw', 'reference', 'columns', 'versions']:
+            (self.store_dir / subdir).mkdir(parents=True, exist_ok=True)
+
+    def manifest_path(self, version: str) -> Path:
+        return self.store_dir / 'versions' / f'{version}.json'
+
+    def column_path(self, definition: str, partition_key: str) -> Path:
+        return self.store_dir / 'columns' / definition / f'{partition_key}.parquet'
+
+    def versions(self) -> list[str]:
+        return sorted(path.stem for path in (self.store_dir / 'versions').glob('*.json'))
+
+    def manifest(self, version: str) -> dict:
+        return json.loads(self.manifest_path(version).read_text())
+
+    def _save_frame(self, subdir: str, frame: pd.DataFrame) -> str:
+        key = frame_hash(frame)
+        path = self.store_dir / subdir / f'{key}.parquet'
+        if not path.exists():
+            _write_atomic(pa.Table.from_pandas(frame, preserve_index=True), path)
+        return key
+
+    def create_version(
+            self,
+            version: str,
+            raw: pd.DataFrame,
+            locations: pd.DataFrame,
+            columns: list[str],
+            table_prefix: str = 'agent',
+            as_is: list[str] | None = None,
+    ) -> dict:
+        """
+        register a new immutable version, no feature is computed here
+
+        :param raw: rows of read_raw_requests ordered by requestid, may have more columns (targets)
+        :param locations: frame of read_locations
+        :param columns: columns of the version: registered features and raw columns (requestid is always one)
+        :param as_is: registered features frozen with their values in raw (from db feature tables)
+        """
+        as_is = as_is or []
+        columns = list(dict.fromkeys(['requestid'] + columns))
+        assert not self.manifest_path(version).exists(), f'version {version} already exists'
+        assert all(column in columns for column in as_is)
+        locations_key = self._save_frame('reference', locations)
+        partitions = {}
+        for date, part in raw.groupby(request_date_partitions(raw, self.date_format), sort=True):
+            partitions[date] = self._save_frame('raw', part.reset_index(drop=True))
+        manifest = {
+            'table_prefix': table_prefix,
+            'locations': locations_key,
+            'partitions': partitions,
+            'columns': {
+                column: definition_hash(column, table_prefix, locations_key, column in as_is)
+                for column in columns
+            },
+            'as_is': as_is,
+        }
+        self.manifest_path(version).write_text(json.dumps(manifest, indent=2))
+        shared = sum(
+            self.column_path(definition, key).exists()
+            for definition in manifest['columns'].values()
+            for key in partitions.values()
+        )
+        logging.info(
+            'Feature store version %s: %r partitions, %r columns, %r column files shared',
+            version, len(partitions), len(columns), shared,
+        )
+        return manifest
+
+    def _materialize(self, manifest: dict, columns: list[str], partition_key: str, resolver: LocationResolver):
+        """
+        compute missing column files of a partition, one registry run for all of them
+        """
+        raw = read_frame(self.store_dir / 'raw' / f'{partition_key}.parquet')
+        frame = compute_columns(raw, resolver, columns, manifest['table_prefix'], manifest['as_is'])
+        for column in columns:
+            _write_atomic(
+                pa.Table.from_pandas(frame[[column]], preserve_index=False),
+                self.column_path(manifest['columns'][column], partition_key),
+            )
+
+    def read(self, version: str, columns: list[str] | None = None, dates: list[str] | None = None) -> pd.DataFrame:
+        """
+        option rows of version ordered by requestid (as prepare_features reads them)
+
+        :param columns: columns of the version, all of them by default
+        :param dates: partitions (request dates in date_format of the store) to read, all by default
+        """
+        manifest = self.manifest(version)
+        columns = columns or list(manifest['columns'])
+        unknown = [column for column in columns if column not in manifest['columns']]
+        assert not unknown, f'columns not in version {version}: {unknown}'
+        # requestid orders rows of partitions, read even when not asked for
+        read_columns = list(dict.fromkeys(columns + ['requestid']))
+        partitions = {
+            date: key for date, key in manifest['partitions'].items()
+            if dates is None or date in dates
+        }
+        resolver = None
+        parts = []
+        for key in partitions.values():
+            missing = [
+                column for column in read_columns
+                if not self.column_path(manifest['columns'][column], key).exists()
+            ]
+            if missing:
+                if resolver is None:
+                    locations_path = self.store_dir / 'reference' / f'{manifest["locations"]}.parquet'
+                    resolver = LocationResolver(read_frame(locations_path))
+                self._materialize(manifest, missing, key, resolver)
+            parts.append(pd.concat(
+                [
+                    read_frame(self.column_path(manifest['columns'][column], key))
+                    for column in read_columns
+                ],
+                axis=1,
+            ))
+        if not parts:
+            return pd.DataFrame(columns=columns)
+        data = pd.concat(parts, ignore_index=True)
+        if len(parts) > 1:
+            order = np.argsort(data['requestid'].to_numpy(), kind='stable')
+            data = data.iloc[order].reset_index(drop=True)
+        data = data[columns]
+        logging.info('Feature store %s read: %r rows, %r columns', version, len(data), len(columns))
+        return data
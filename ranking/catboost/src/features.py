@@ -0,0 +1,574 @@
+import logging
+import re
+
+import numpy as np
+import pandas as pd
+import sqlalchemy
+from sqlalchemy import Connection, Engine, text
+
+from ranking.catboost.src.dedup import same_option_classes
+from ranking.catboost.src.durations import epoch_seconds, request_duration_features, span, trip_durations
+from ranking.catboost.src.group_kernels import diff_from_min, group_min, rank, ratio_to_min
+from ranking.catboost.src.groups import RequestGroups
+from ranking.catboost.src.locations import LocationResolver
+from ranking.catboost.src.parser import parse_locations
+from ranking.catboost.src.registry import REQUEST, FeatureRegistry
+
+# columns of {table_prefix}_requests used by features, client_requests has arrivadate instead of arrivaldate
+RAW_COLUMNS = [
+    'id',
+    'requestid',
+    'requestdate',
+    'clientid',
+    'travellergrade',
+    'searchroute',
+    'requestdeparturedate',
+    'requestreturndate',
+    'fligtoption',
+    'departuredate',
+    'arrivaldate',
+    'returndepatruredate',
+    'returnarrivaldate',
+    'segmentcount',
+    'amount',
+    'class',
+    'isbaggage',
+    'isrefundpermitted',
+    'isexchangepermitted',
+    'isdiscount',
+    'intravelpolicy',
+]
+PARSED_INFO_COLUMNS = [
+    'to_departure_iata',
+    'to_arrival_iata',
+    'return_arrival_iata',
+    'first_flight_option_operator_code',
+    'first_flight_option_operator_count',
+]
+DATE_COLUMNS = [
+    'requestdate',
+    'requestdeparturedate',
+    'requestreturndate',
+    'departuredate',
+    'arrivaldate',
+    'returndepatruredate',
+    'returnarrivaldate',
+]
+REQUEST_FEATURES_TABLES = {
+    'agent': 'request_features',
+    'client': 'request_features_c',
+    'final_test': 'request_features_ft',
+}
+TOP_OPERATORS = [
+    'SU', 'S7', 'EK', 'TK', 'DP', 'U6', 'UT', 'PC', 'EY', 'QR', 'FZ', 'MS', 'WZ', 'HY', '5N', 'DV', 'N4', 'A4', 'LH',
+]
+TOP_CITIES = ['MOW', 'LED', 'IST', 'KJA', 'ALA', 'AER', 'VVO', 'IKT', 'DXB', 'GOJ', 'NQZ', 'SVX', 'KUF', 'OVB']
+TOP_CLIENTS = [26390, 54545, 45001, 45230, 2519, 40811, 45112, 2175]
+
+REQUEST_FEATURES = [
+    'request_id',
+    'has_intravelpolicy_variant',
+    'has_intravelpolicy_variant_1_segment',
+    'min_price',
+    'has_not_economy_in_policy',
+    'min_return_time',
+    'min_to_time',
+    'min_departure_diff_seconds',
+    'min_segments_count',
+    'min_total_flight_time',
+    'departuredate_variability',
+    'flights_variability',
+]
+# columns of {table_prefix}_requests_features in the table order
+OPTION_FEATURES = [
+    'id',
+    'request_id',
+    'has_intravelpolicy_variant',
+    'has_intravelpolicy_variant_1_segment',
+    'min_price',
+    'price_diff',
+    'price_ratio',
+    'has_not_economy_in_policy',
+    'min_return_time',
+    'return_time',
+    'return_time_abs',
+    'return_time_abs_ratio',
+    'min_to_time',
+    'to_time',
+    'to_time_abs',
+    'to_time_abs_ratio',
+    'departuredate_variability',
+    'min_departure_diff_seconds',
+    'departure_diff_seconds',
+    'client_has_travellergrade',
+    'client_travellergrade',
+    'class_is_economy',
+    'class_is_business',
+    'min_segments_count',
+    'segments_diff',
+    'one_segment_trip',
+    'departure_hour',
+    'arrival_hour',
+    'return_departure_hour',
+    'return_arrival_hour',
+    'total_flight_time',
+    'min_total_flight_time',
+    'total_flight_ratio',
+    'round_trip',
+    'operator_count',
+    'operator_code',
+    'is_international',
+    'timezone_diff',
+    'to_city_timezone',
+    'from_city_timezone',
+    'to_city_iatacode',
+    'from_city_iatacode',
+    'departure_week_day',
+    'return_week_day',
+    'request_before_x_days',
+    'stay_x_days',
+    'price_rank',
+    'price_leg_rank',
+    'duration_rank',
+    'segments_rank',
+    'client',
+    'same_options_best_price',
+    'flights_variability',
+    # equivalence class key of option (see dedup.SAME_OPTION_COLUMNS), not in sql built tables
+    'same_option_class',
+]
+
+
+def read_raw_requests(
+        engine: Engine | Connection,
+        table_prefix: str = 'agent',
+        requestids_table: str | None = None,
+        parse_in_process: bool = False,
+) -> pd.DataFrame:
+    """
+    option rows with their parsed locations and operators, ordered by requestid
+
+    :param requestids_table: table with request_id column to read only these requests
+    :param parse_in_process: parse searchroute and fligtoption with parser module
+        instead of joining {table_prefix}_request_parsed_info
+    """
+    assert re.match("^[a-z0-9_]*$", table_prefix)
+    requests_table = f'{table_prefix}_requests'
+    columns = []
+    for column in RAW_COLUMNS:
+        if table_prefix == 'client' and column == 'arrivaldate':
+            columns.append('r.arrivadate as arrivaldate')
+        elif table_prefix == 'client' and column == 'travellergrade':
+            columns.append('null as travellergrade')
+        else:
+            columns.append(f'r.{column}')
+    if parse_in_process:
+        query = f'SELECT {", ".join(columns)}\nFROM {requests_table} r\n'
+    else:
+        query = (
+            f'SELECT {", ".join(columns + [f"pi.{column}" for column in PARSED_INFO_COLUMNS])}\n'
+            f'FROM {requests_table} r\n'
+            f'join {table_prefix}_request_parsed_info pi on r.id = pi.{table_prefix}_request_id\n'
+        )
+    if requestids_table is not None:
+        assert re.match("^[a-z0-9_]*$", requestids_table)
+        query += f'join {requestids_table} ids on ids.request_id = r.requestid\n'
+    query += 'order by r.requestid, r.id'
+
+    raw = pd.read_sql(query, engine, dtype={'amount': 'float64'}, parse_dates=DATE_COLUMNS)
+    if parse_in_process:
+        raw = pd.concat([raw, parse_locations(raw)[PARSED_INFO_COLUMNS]], axis=1)
+    logging.info('%s raw requests read: %r rows', table_prefix, len(raw))
+    return raw
+
+
+def _nullable_int(values: np.ndarray) -> pd.arrays.IntegerArray:
+    """
+    values as stored in an int column (postgres rounds float to the nearest), NaN as null
+    """
+    missing = np.isnan(values)
+    return pd.arrays.IntegerArray(np.where(missing, 0, np.rint(values)).astype(np.int64), missing)
+
+
+def _group_bool_or(groups: RequestGroups, values: pd.arrays.BooleanArray) -> pd.arrays.BooleanArray:
+    """
+    bool_or aggregate: true if any true, null if all values are null
+    """
+    has_true = groups.count(values.fillna(False).to_numpy(dtype=bool)) > 0
+    has_value = groups.count(~values.isna()) > 0
+    return pd.arrays.BooleanArray(has_true, ~has_value)
+
+
+def _group_count_distinct(groups: RequestGroups, values: pd.Series) -> np.ndarray:
+    """
+    count(distinct value) per group, nulls are not counted
+    """
+    value_codes, uniques = pd.factorize(values)
+    known = value_codes >= 0
+    keys = groups.codes[known] * max(len(uniques), 1) + value_codes[known]
+    return np.bincount(np.unique(keys) // max(len(uniques), 1), minlength=groups.groups_count)
+
+
+def _values(column: pd.Series) -> np.ndarray:
+    return column.to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+def _top_or(column: pd.Series, top: list, other: str) -> np.ndarray:
+    return column.where(column.isin(top), other).to_numpy()
+
+
+def _nullable_bool(values: pd.Series) -> pd.arrays.BooleanArray:
+    return pd.array(values, dtype='boolean')
+
+
+# sources: raw rows of read_raw_requests (all of them, before location joins), LocationResolver, table prefix
+FEATURES = FeatureRegistry(sources=['requests', 'locations', 'table_prefix'])
+
+# classes are over all options, the location joins do not affect them
+FEATURES.add('option_classes', ['requests'], same_option_classes, grain=None)
+for _name, _column in [
+    ('departure_city', 'to_departure_iata'),
+    ('arrival_city', 'to_arrival_iata'),
+    ('return_arrival_city', 'return_arrival_iata'),
+]:
+    FEATURES.add(
+        _name,
+        ['requests', 'locations'],
+        lambda requests, locations, column=_column: locations.resolve(requests[column]).reset_index(drop=True),
+        grain=None,
+    )
+# inner joins of departure and arrival cities drop options with unknown locations
+FEATURES.add('located', ['departure_city', 'arrival_city'],
+             lambda departure, arrival: (departure['known'] & arrival['known']).to_numpy(), grain=None)
+
+# raw columns of located options
+for _column in RAW_COLUMNS + PARSED_INFO_COLUMNS:
+    FEATURES.add(
+        _column,
+        ['requests', 'located'],
+        lambda requests, located, column=_column: requests[column][located].reset_index(drop=True),
+    )
+for _column in DATE_COLUMNS:
+    FEATURES.add(f'{_column}_epoch', [_column], epoch_seconds, grain=None)
+for _name in ['departure', 'arrival', 'return_arrival']:
+    FEATURES.add(_name, [f'{_name}_city', 'located'],
+                 lambda city, located: city[located].reset_index(drop=True), grain=None)
+    FEATURES.add(f'{_name}_timezone', [_name], lambda city: city['timezone'].to_numpy(), grain=None)
+
+FEATURES.add('groups', ['requestid'], lambda requestid: RequestGroups(requestid.to_numpy()), grain=None)
+FEATURES.add('price', ['amount'], _values, grain=None)
+FEATURES.add('segments', ['segmentcount'], _values, grain=None)
+FEATURES.add(
+    'durations',
+    [
+        'departuredate_epoch',
+        'arrivaldate_epoch',
+        'returndepatruredate_epoch',
+        'returnarrivaldate_epoch',
+        'departure_timezone',
+        'arrival_timezone',
+        'return_arrival_timezone',
+    ],
+    trip_durations,
+    grain=None,
+)
+FEATURES.add(
+    'duration_features',
+    ['groups', 'durations', 'departure_timezone', 'arrival_timezone', 'return_arrival_timezone'],
+    request_duration_features,
+    grain=None,
+)
+FEATURES.add('departure_diff', ['requestdeparturedate_epoch', 'departuredate_epoch'], span, grain=None)
+FEATURES.add('in_policy', ['intravelpolicy'], lambda column: column.astype('boolean').array, grain=None)
+FEATURES.add('one_segment', ['segmentcount'],
+             lambda column: _nullable_bool(column.eq(1).mask(column.isna())), grain=None)
+FEATURES.add('request_min_segments', ['groups', 'segments'], group_min, grain=None)
+
+# request grain features (request_features tables), broadcast to options in {table_prefix}_requests_features
+FEATURES.add('has_intravelpolicy_variant', ['groups', 'in_policy'], _group_bool_or, grain=REQUEST)
+FEATURES.add('has_intravelpolicy_variant_1_segment', ['groups', 'in_policy', 'one_segment'],
+             lambda groups, in_policy, one_segment: _group_bool_or(groups, in_policy & one_segment), grain=REQUEST)
+FEATURES.add('min_price', ['groups', 'price'], group_min, grain=REQUEST)
+FEATURES.add('has_not_economy_in_policy', ['groups', 'class_is_economy', 'in_policy'],
+             lambda groups, is_economy, in_policy: _group_bool_or(groups, ~is_economy & in_policy), grain=REQUEST)
+for _name in ['min_return_time', 'min_to_time', 'min_total_flight_time']:
+    FEATURES.add(_name, ['duration_features'],
+                 lambda duration_features, name=_name: _nullable_int(duration_features[name]), grain=REQUEST)
+FEATURES.add('min_departure_diff_seconds', ['groups', 'departure_diff'],
+             lambda groups, departure_diff: _nullable_int(group_min(groups, np.abs(departure_diff))), grain=REQUEST)
+FEATURES.add('min_segments_count', ['request_min_segments'], _nullable_int, grain=REQUEST)
+FEATURES.add('departuredate_variability', ['groups', 'departuredate'], _group_count_distinct, grain=REQUEST)
+FEATURES.add('flights_variability', ['groups', 'fligtoption'], _group_count_distinct, grain=REQUEST)
+
+# option grain features
+FEATURES.add('request_id', ['requestid'], lambda requestid: requestid.to_numpy())
+FEATURES.add('price_diff', ['groups', 'price'], diff_from_min)
+FEATURES.add('price_ratio', ['groups', 'price'], ratio_to_min)
+for _name in ['return_time', 'return_time_abs', 'to_time', 'to_time_abs', 'total_flight_time']:
+    FEATURES.add(_name, ['durations'], lambda durations, name=_name: _nullable_int(durations[name]))
+for _name in ['return_time_abs_ratio', 'to_time_abs_ratio', 'total_flight_ratio']:
+    FEATURES.add(_name, ['duration_features'], lambda duration_features, name=_name: duration_features[name])
+FEATURES.add('departure_diff_seconds', ['departure_diff'], _nullable_int)
+
+
+@FEATURES.register('client_travellergrade', ['travellergrade', 'table_prefix'])
+def _client_travellergrade(travellergrade: pd.Series, table_prefix: str) -> np.ndarray:
+    if table_prefix != 'agent':
+        return np.full(len(travellergrade), -1, dtype=np.int64)
+    return np.nan_to_num(_values(travellergrade), nan=-1).astype(np.int64)
+
+
+FEATURES.add('client_has_travellergrade', ['travellergrade', 'table_prefix'],
+             lambda travellergrade, table_prefix: travellergrade.notna().to_numpy() & (table_prefix == 'agent'))
+FEATURES.add('class_is_economy', ['class'], lambda column: _nullable_bool(column.eq('E').mask(column.isna())))
+FEATURES.add('class_is_business', ['class'],
+             lambda column: _nullable_bool(column.isin(['B', 'C']).mask(column.isna())))
+FEATURES.add('segments_diff', ['groups', 'segments', 'request_min_segments'],
+             lambda groups, segments, min_segments: _nullable_int(segments - groups.broadcast(min_segments)))
+FEATURES.add('one_segment_trip', ['searchroute'],
+             lambda column: ~column.str.contains('/', regex=False).astype('boolean').array)
+for _name, _column in [
+    ('departure_hour', 'departuredate'),
+    ('arrival_hour', 'arrivaldate'),
+    ('return_departure_hour', 'returndepatruredate'),
+    ('return_arrival_hour', 'returnarrivaldate'),
+]:
+    FEATURES.add(_name, [_column], lambda column: _nullable_int(_values(column.dt.hour)))
+FEATURES.add('round_trip', ['to_departure_iata', 'return_arrival_iata'],
+             lambda departure, return_arrival: _nullable_bool(departure.eq(return_arrival).mask(return_arrival.isna())))
+FEATURES.add('operator_count', ['first_flight_option_operator_count'], lambda column: _nullable_int(_values(column)))
+FEATURES.add('operator_code', ['first_flight_option_operator_code'],
+             lambda column: _top_or(column, TOP_OPERATORS, 'XX'))
+FEATURES.add(
+    'is_international',
+    ['departure', 'arrival'],
+    lambda departure, arrival: _nullable_bool(
+        arrival['countrycode'].ne(departure['countrycode'])
+        .mask(arrival['countrycode'].isna() | departure['countrycode'].isna())
+    ),
+)
+FEATURES.add('timezone_diff', ['departure_timezone', 'arrival_timezone'],
+             lambda from_timezone, to_timezone: to_timezone - from_timezone)
+FEATURES.add('to_city_timezone', ['arrival_timezone'], lambda timezone: timezone)
+FEATURES.add('from_city_timezone', ['departure_timezone'], lambda timezone: timezone)
+FEATURES.add('to_city_iatacode', ['arrival'], lambda city: _top_or(city['iatacode'], TOP_CITIES, 'XXX'))
+FEATURES.add('from_city_iatacode', ['departure'], lambda city: _top_or(city['iatacode'], TOP_CITIES, 'XXX'))
+FEATURES.add('departure_week_day', ['departuredate'], lambda column: _nullable_int(_values(column.dt.dayofweek) + 1))
+FEATURES.add('return_week_day', ['returnarrivaldate'],
+             lambda column: _nullable_int(_values(column.dt.dayofweek) + 1))
+# extract(days from interval) keeps the whole days part, truncated towards zero
+FEATURES.add('request_before_x_days', ['requestdeparturedate_epoch', 'requestdate_epoch'],
+             lambda end, start: _nullable_int(np.trunc(span(end, start) / 86400)))
+FEATURES.add('stay_x_days', ['requestreturndate_epoch', 'requestdeparturedate_epoch'],
+             lambda end, start: _nullable_int(np.trunc(span(end, start) / 86400)))
+FEATURES.add('price_rank', ['groups', 'price'], lambda groups, price: rank(groups, [price]))
+FEATURES.add('price_leg_rank', ['groups', 'segments', 'price'],
+             lambda groups, segments, price: rank(groups, [segments, price]))
+FEATURES.add('duration_rank', ['groups', 'durations'],
+             lambda groups, durations: rank(groups, [durations['duration_rank_key']]))
+FEATURES.add('segments_rank', ['groups', 'segments'], lambda groups, segments: rank(groups, [segments]))
+FEATURES.add('client', ['clientid'],
+             lambda column: np.where(column.isin(TOP_CLIENTS), column.astype(str), 'XX'))
+FEATURES.add('same_options_best_price', ['option_classes', 'located'], lambda classes, located: classes[1][located])
+FEATURES.add('same_option_class', ['option_classes', 'located'], lambda classes, located: classes[0][located])
+
+
+def _option_frame(values: dict, columns: list[str], as_is: list[str]) -> pd.DataFrame:
+    """
+    option rows of columns from computed values: request grain features broadcast to options,
+    not registered columns and as_is ones taken from raw rows
+    """
+    groups, located, requests = values['groups'], values['located'], values['requests']
+    frame = {}
+    for column in columns:
+        if column not in FEATURES or column in as_is:
+            frame[column] = requests[column][located].reset_index(drop=True)
+        elif FEATURES[column].grain == REQUEST:
+            frame[column] = values[column][groups.codes]
+        else:
+            frame[column] = values[column]
+    return pd.DataFrame(frame)
+
+
+def compute_columns(
+        raw: pd.DataFrame,
+        locations: LocationResolver,
+        columns: list[str],
+        table_prefix: str = 'agent',
+        as_is: list[str] | None = None,
+) -> pd.DataFrame:
+    """
+    option rows with only the wanted columns (a model used_columns): features of the registry are computed
+    with their dependencies and nothing else, other columns are taken as they are in raw
+
+    :param as_is: registered features taken from raw too (values frozen from db feature tables)
+    """
+    as_is = as_is or []
+    sources = {'requests': raw, 'locations': locations, 'table_prefix': table_prefix}
+    names = [column for column in columns if column in FEATURES and column not in as_is]
+    frame = _option_frame(FEATURES.compute(names + ['groups'], sources), columns, as_is)
+    logging.info('%s columns computed: %r options, %r features', table_prefix, len(frame), len(names))
+    return frame
+
+
+def compute_features(
+        raw: pd.DataFrame,
+        locations: LocationResolver,
+        table_prefix: str = 'agent',
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    request_features and {table_prefix}_requests_features rows as 0029_post_final_features.sql makes them
+    (0023 for client, 0033 for final_test)
+
+    :param raw: rows of read_raw_requests
+    :param locations: iata codes reference
+    :return: request features, option features
+    """
+    sources = {'requests': raw, 'locations': locations, 'table_prefix': table_prefix}
+    values = FEATURES.compute(OPTION_FEATURES + REQUEST_FEATURES[1:] + ['groups'], sources)
+    request = pd.DataFrame({
+        'request_id': values['groups'].keys,
+        **{column: values[column] for column in REQUEST_FEATURES[1:]},
+    })
+    option = _option_frame(values, OPTION_FEATURES, [])
+    logging.info('%s features computed: %r requests, %r options', table_prefix, len(request), len(option))
+    return request, option
+
+
+def _sql_type(dtype) -> str:
+    """
+    db type of a computed column the sql built table has not
+    """
+    if pd.api.types.is_bool_dtype(dtype):
+        return 'bool'
+    if pd.api.types.is_integer_dtype(dtype):
+        return 'bigint'
+    if pd.api.types.is_float_dtype(dtype):
+        return 'float'
+    return 'text'
+
+
+def write_features(
+        engine: Engine,
+        table_prefix: str,
+        request_features: pd.DataFrame,
+        option_features: pd.DataFrame,
+        chunk_size: int = 10000,
+):
+    """
+    replace rows of request features and {table_prefix}_requests_features tables with computed ones
+    in one transaction; tables keep their sql DDL (decimal types, references, indexes), computed columns
+    they have not are added; tables are created from frames only when there are none yet
+    """
+    assert re.match("^[a-z0-9_]*$", table_prefix)
+    with engine.begin() as connection:
+        inspector = sqlalchemy.inspect(connection)
+        for table_name, frame, key in [
+            (REQUEST_FEATURES_TABLES[table_prefix], request_features, 'request_id'),
+            (f'{table_prefix}_requests_features', option_features, 'id'),
+        ]:
+            if not inspector.has_table(table_name):
+                frame.to_sql(table_name, connection, index=False, chunksize=chunk_size)
+                connection.execute(text(f'ALTER TABLE {table_name} ADD PRIMARY KEY ({key})'))
+                logging.info('%s created: %r rows', table_name, len(frame))
+                continue
+            table_columns = {column['name'] for column in inspector.get_columns(table_name)}
+            for column in frame.columns:
+                if column not in table_columns:
+                    connection.execute(text(
+                        f'ALTER TABLE {table_name} ADD COLUMN "{column}" {_sql_type(frame[column].dtype)}'
+                    ))
+            # delete, not truncate: readers see old rows until commit
+            connection.execute(text(f'DELETE FROM {table_name}'))
+            frame.to_sql(table_name, connection, if_exists='append', index=False, chunksize=chunk_size)
+            logging.info('%s saved: %r rows', table_name, len(frame))
+
+
+def _mismatches(computed: pd.Series, stored: pd.Series, rtol: float, atol: float) -> int:
+    """
+    rows where values differ, nulls are equal to nulls only; numbers are compared with tolerance
+    (decimal(16, 2) columns are rounded in db)
+    """
+    if pd.api.types.is_bool_dtype(computed):
+        stored = stored.astype('boolean')
+    if pd.api.types.is_numeric_dtype(computed):
+        left = computed.to_numpy(dtype=np.float64, na_value=np.nan)
+        right = pd.to_numeric(stored, errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+        return int(np.count_nonzero(~np.isclose(left, right, rtol=rtol, atol=atol, equal_nan=True)))
+    left_null, right_null = computed.isna().to_numpy(), stored.isna().to_numpy()
+    both = ~left_null & ~right_null
+    same = computed[both].astype(str).to_numpy() == stored[both].astype(str).to_numpy()
+    return int(np.count_nonzero(left_null != right_null) + np.count_nonzero(~same))
+
+
+def compare_features(
+        stored_tables: dict[str, pd.DataFrame],
+        request_features: pd.DataFrame,
+        option_features: pd.DataFrame,
+        table_prefix: str = 'agent',
+        rtol: float = 1e-6,
+        atol: float = 0.01,
+) -> pd.DataFrame:
+    """
+    :param stored_tables: request features and {table_prefix}_requests_features tables rows by table name
+    :return: one row per column of both: table, column, rows (matched by key), missing (rows of one side only),
+        mismatches
+    """
+    result = []
+    for table_name, frame, key in [
+        (REQUEST_FEATURES_TABLES[table_prefix], request_features, 'request_id'),
+        (f'{table_prefix}_requests_features', option_features, 'id'),
+    ]:
+        merged = frame.merge(stored_tables[table_name], on=key, how='outer', suffixes=('', '_db'), indicator=True)
+        matched = merged[merged['_merge'] == 'both']
+        for column in frame.columns:
+            if f'{column}_db' not in merged.columns:
+                continue
+            result.append({
+                'table': table_name,
+                'column': column,
+                'rows': len(matched),
+                'missing': len(merged) - len(matched),
+                'mismatches': _mismatches(matched[column], matched[f'{column}_db'], rtol, atol),
+            })
+    return pd.DataFrame(result)
+
+
+def feature_parity(engine: Engine, table_prefix: str = 'agent') -> pd.DataFrame:
+    """
+    compare features computed in process with the sql built tables (0029_post_final_features.sql),
+    run it before build_features replaces them
+
+    :return: compare_features table, columns with mismatches are logged
+    """
+    request_features, option_features = compute_features(
+        read_raw_requests(engine, table_prefix, parse_in_process=True),
+        LocationResolver.from_db(engine),
+        table_prefix,
+    )
+    stored_tables = {
+        table_name: pd.read_sql(f'SELECT * FROM {table_name}', engine)
+        for table_name in [REQUEST_FEATURES_TABLES[table_prefix], f'{table_prefix}_requests_features']
+    }
+    parity = compare_features(stored_tables, request_features, option_features, table_prefix)
+    differing = parity[(parity['mismatches'] > 0) | (parity['missing'] > 0)]
+    if len(differing):
+        logging.warning('%s features differ from sql build:\n%s', table_prefix, differing.to_string(index=False))
+    else:
+        logging.info('%s features match sql build: %r columns', table_prefix, len(parity))
+    return parity
+
+
+def build_features(engine: Engine, table_prefix: str = 'agent') -> int:
+    """
+    recompute all features of table_prefix requests in process and save them to db
+
+    :return: requests count
+    """
+    request_features, option_features = compute_features(
+        read_raw_requests(engine, table_prefix, parse_in_process=True),
+        LocationResolver.from_db(engine),
+        table_prefix,
+    )
+    write_features(engine, table_prefix, request_features, option_features)
+    return len(request_features)
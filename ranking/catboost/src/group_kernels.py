@@ -0,0 +1,116 @@
+import numpy as np
+
+from ranking.catboost.src.groups import RequestGroups
+
+
+def _sort_keys(keys: list[np.ndarray], descending: bool) -> list[np.ndarray]:
+    """
+    (null flag, value) pairs of keys in priority order, nulls are equal to each other
+    and go last for ascending and first for descending order, as in postgres
+    """
+    result = []
+    for key in keys:
+        values = np.asarray(key, dtype=np.float64)
+        nulls = np.isnan(values)
+        filled = np.where(nulls, 0, values)
+        if descending:
+            result += [~nulls, -filled]
+        else:
+            result += [nulls, filled]
+    return result
+
+
+def sort_within_groups(
+        groups: RequestGroups,
+        keys: list[np.ndarray],
+        descending: bool = False,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    one lexsort of rows by (group, keys)
+
+    :param keys: row values, most significant first, NaN as null
+    :return: row positions in that order, flags of rows starting a run of equal keys in the group
+    """
+    sort_keys = _sort_keys(keys, descending)
+    positions = np.lexsort([*reversed(sort_keys), groups.codes])
+    sorted_codes = groups.codes[positions]
+    new_run = np.ones(len(positions), dtype=bool)
+    new_run[1:] = sorted_codes[1:] != sorted_codes[:-1]
+    for key in sort_keys:
+        sorted_key = key[positions]
+        new_run[1:] |= sorted_key[1:] != sorted_key[:-1]
+    return positions, new_run
+
+
+def rank(groups: RequestGroups, keys: list[np.ndarray], descending: bool = False) -> np.ndarray:
+    """
+    rank() over (partition by requestid order by keys): 1 + count of rows of the request before the row,
+    equal rows share rank and leave gaps
+    """
+    positions, new_run = sort_within_groups(groups, keys, descending)
+    run_starts = np.maximum.accumulate(np.where(new_run, np.arange(len(positions)), 0))
+    ranks = np.empty(len(positions), dtype=np.int64)
+    ranks[positions] = run_starts - groups.starts[groups.codes[positions]] + 1
+    return ranks
+
+
+def dense_rank(groups: RequestGroups, keys: list[np.ndarray], descending: bool = False) -> np.ndarray:
+    """
+    dense_rank(): number of distinct keys of the request up to the row, no gaps
+    """
+    positions, new_run = sort_within_groups(groups, keys, descending)
+    runs = np.cumsum(new_run)
+    sorted_codes = groups.codes[positions]
+    # runs count before the group start
+    runs_before = runs[groups.starts] - 1
+    ranks = np.empty(len(positions), dtype=np.int64)
+    ranks[positions] = runs - runs_before[sorted_codes]
+    return ranks
+
+
+def top_k_mask(groups: RequestGroups, scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    rows with rank() over score desc not greater than k (ties at the border are all kept)
+    """
+    return rank(groups, [scores], descending=True) <= k
+
+
+def group_min(groups: RequestGroups, values: np.ndarray) -> np.ndarray:
+    """
+    min per group ignoring NaN (nulls), NaN if all values are null
+    """
+    return groups.reduce(np.asarray(values, dtype=np.float64), np.fmin)
+
+
+def group_max(groups: RequestGroups, values: np.ndarray) -> np.ndarray:
+    return groups.reduce(np.asarray(values, dtype=np.float64), np.fmax)
+
+
+def diff_from_min(groups: RequestGroups, values: np.ndarray) -> np.ndarray:
+    """
+    value - min(value) over request
+    """
+    return values - groups.broadcast(group_min(groups, values))
+
+
+def ratio_to_min(groups: RequestGroups, values: np.ndarray) -> np.ndarray:
+    """
+    value / nullif(min(value) over request, 0)
+    """
+    minimums = groups.broadcast(group_min(groups, values))
+    return values / np.where(minimums == 0, np.nan, minimums)
+
+
+def zscore(groups: RequestGroups, values: np.ndarray) -> np.ndarray:
+    """
+    (value - avg) / stddev_pop over request, nulls ignored, NaN for constant groups
+    """
+    values = np.asarray(values, dtype=np.float64)
+    known = ~np.isnan(values)
+    filled = np.where(known, values, 0)
+    counts = groups.count(known)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = groups.reduce(filled) / counts
+        deviations = np.where(known, values - groups.broadcast(means), 0)
+        stds = np.sqrt(groups.reduce(deviations ** 2) / counts)
+        return (values - groups.broadcast(means)) / groups.broadcast(np.where(stds == 0, np.nan, stds))
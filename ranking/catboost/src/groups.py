@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+
+
+class RequestGroups:
+    """
+    Index of frame rows by request (CSR layout).
+
+    `order` lists row positions in requestid order (stable, so rows of a request keep the frame order),
+    rows of group g are `order[starts[g]:ends[g]]`. Groups are numbered in requestid order and
+    `codes` maps every row to its group. Data read by flows is ordered by requestid already,
+    then `order` is the identity and a group is a plain slice of the frame.
+    """
+
+    def __init__(self, keys: np.ndarray | pd.Series):
+        """
+        :param keys: requestid of every row
+        """
+        keys = np.asarray(keys)
+        self.is_sorted: bool = bool(len(keys) < 2 or (keys[1:] >= keys[:-1]).all())
+        if self.is_sorted:
+            self.order: np.ndarray = np.arange(len(keys), dtype=np.int64)
+            sorted_keys = keys
+        else:
+            self.order = np.argsort(keys, kind='stable')
+            sorted_keys = keys[self.order]
+
+        is_start = np.ones(len(keys), dtype=bool)
+        is_start[1:] = sorted_keys[1:] != sorted_keys[:-1]
+        self.starts: np.ndarray = np.flatnonzero(is_start)
+        self.ends: np.ndarray = np.append(self.starts[1:], len(keys)).astype(np.int64)
+        self.sizes: np.ndarray = self.ends - self.starts
+        self.keys: np.ndarray = sorted_keys[self.starts]
+
+        # group of every row in sorted order, then scattered back to the frame order
+        sorted_codes = np.cumsum(is_start, dtype=np.int64) - 1
+        if self.is_sorted:
+            self.codes: np.ndarray = sorted_codes
+        else:
+            self.codes = np.empty(len(keys), dtype=np.int64)
+            self.codes[self.order] = sorted_codes
+        self._positions: dict | None = None
+
+    @property
+    def groups_count(self) -> int:
+        return len(self.starts)
+
+    @property
+    def rows_count(self) -> int:
+        return len(self.order)
+
+    def rows(self, group: int) -> np.ndarray:
+        """
+        frame positions of rows of the group
+        """
+        return self.order[self.starts[group]:self.ends[group]]
+
+    def group_of(self, requestid) -> int:
+        """
+        group number of requestid, KeyError for unknown request
+        """
+        if self._positions is None:
+            self._positions = dict(zip(self.keys.tolist(), range(self.groups_count)))
+        return self._positions[requestid]
+
+    def request_rows(self, requestid) -> np.ndarray:
+        return self.rows(self.group_of(requestid))
+
+    def to_sorted(self, values: np.ndarray) -> np.ndarray:
+        """
+        row values rearranged in requestid order (no copy when the frame is ordered already)
+        """
+        return values if self.is_sorted else values[self.order]
+
+    def from_sorted(self, sorted_values: np.ndarray) -> np.ndarray:
+        """
+        inverse of to_sorted
+        """
+        if self.is_sorted:
+            return sorted_values
+        result = np.empty_like(sorted_values)
+        result[self.order] = sorted_values
+        return result
+
+    def broadcast(self, group_values: np.ndarray) -> np.ndarray:
+        """
+        per group values repeated for every row of the group, in the frame order
+        """
+        return group_values[self.codes]
+
+    def reduce(self, values: np.ndarray, ufunc: np.ufunc = np.add) -> np.ndarray:
+        """
+        per group reduction of row values, e.g. np.minimum for group min (groups are never empty)
+        """
+        if self.groups_count == 0:
+            return np.empty(0, dtype=values.dtype)
+        return ufunc.reduceat(self.to_sorted(values), self.starts)
+
+    def count(self, mask: np.ndarray) -> np.ndarray:
+        """
+        rows count per group where mask is set
+        """
+        return np.bincount(self.codes[mask], minlength=self.groups_count)
@@ -0,0 +1,132 @@
+import logging
+import re
+
+import sqlalchemy
+from sqlalchemy import Connection, Engine, text
+
+from ranking.catboost.src.features import (
+    OPTION_FEATURES,
+    REQUEST_FEATURES,
+    REQUEST_FEATURES_TABLES,
+    build_features,
+    compute_features,
+    read_raw_requests,
+)
+from ranking.catboost.src.locations import LocationResolver
+
+
+def state_table_name(table_prefix: str) -> str:
+    return f'{table_prefix}_requests_features_state'
+
+
+def _hashes_query(table_prefix: str) -> str:
+    """
+    md5 of raw rows of every request, a request with any changed, added or deleted option gets a new hash
+    """
+    return (
+        f"SELECT r.requestid as request_id, md5(string_agg(r::text, '|' order by r.id)) as rows_hash\n"
+        f"FROM {table_prefix}_requests r\n"
+        f"group by r.requestid"
+    )
+
+
+def save_state(connection: Connection, table_prefix: str):
+    """
+    remember hashes of all requests as built
+    """
+    state_table = state_table_name(table_prefix)
+    connection.execute(text(f'DROP TABLE if exists {state_table}'))
+    connection.execute(text(f'CREATE TABLE {state_table} AS {_hashes_query(table_prefix)}'))
+    connection.execute(text(f'ALTER TABLE {state_table} ADD PRIMARY KEY (request_id)'))
+
+
+def update_features(engine: Engine, table_prefix: str = 'agent', chunk_size: int = 10000) -> int:
+    """
+    refresh features of new and changed requests only and drop features of deleted ones;
+    the first run (no state yet) and runs after new features were added (tables lack their columns)
+    build everything
+
+    Locations (cities, iata codes) are not tracked, rebuild with build_features after changing them.
+
+    :return: count of refreshed requests
+    """
+    assert re.match("^[a-z0-9_]*$", table_prefix)
+    state_table = state_table_name(table_prefix)
+    request_table = REQUEST_FEATURES_TABLES[table_prefix]
+    option_table = f'{table_prefix}_requests_features'
+    inspector = sqlalchemy.inspect(engine)
+    if not all(inspector.has_table(table) for table in [state_table, request_table, option_table]):
+        logging.info('%s features state not found, full build', table_prefix)
+        full_build = True
+    else:
+        missing_columns = [
+            f'{table}.{column}'
+            for table, columns in [(request_table, REQUEST_FEATURES), (option_table, OPTION_FEATURES)]
+            for column in sorted(set(columns) - {column['name'] for column in inspector.get_columns(table)})
+        ]
+        if missing_columns:
+            logging.info('%s features columns changed (%s), full build', table_prefix, ', '.join(missing_columns))
+        full_build = bool(missing_columns)
+    if full_build:
+        # state first: requests changed during the build are refreshed by the next update
+        with engine.begin() as connection:
+            save_state(connection, table_prefix)
+        return build_features(engine, table_prefix)
+
+    # one transaction: readers see either old or fully refreshed features
+    with engine.begin() as connection:
+        connection.execute(text(
+            f'CREATE TEMP TABLE _request_hashes ON COMMIT DROP AS {_hashes_query(table_prefix)}'
+        ))
+        connection.execute(text(
+            f"""
+                CREATE TEMP TABLE _changed_requests ON COMMIT DROP AS
+                SELECT c.request_id
+                FROM _request_hashes c
+                left join {state_table} s on s.request_id = c.request_id
+                where s.rows_hash is distinct from c.rows_hash
+            """
+        ))
+        connection.execute(text(
+            f"""
+                CREATE TEMP TABLE _outdated_requests ON COMMIT DROP AS
+                SELECT request_id FROM _changed_requests
+                UNION
+                SELECT s.request_id
+                FROM {state_table} s
+                left join _request_hashes c on s.request_id = c.request_id
+                where c.request_id is null
+            """
+        ))
+        changed_count = connection.execute(text('select count(*) from _changed_requests')).scalar_one()
+        outdated_count = connection.execute(text('select count(*) from _outdated_requests')).scalar_one()
+        logging.info(
+            '%s features refresh: %r new or changed requests, %r deleted',
+            table_prefix,
+            changed_count,
+            outdated_count - changed_count,
+        )
+        if outdated_count == 0:
+            return 0
+
+        request_features, option_features = compute_features(
+            read_raw_requests(connection, table_prefix, requestids_table='_changed_requests', parse_in_process=True),
+            LocationResolver.from_db(connection),
+            table_prefix,
+        )
+        for table in [request_table, option_table, state_table]:
+            connection.execute(text(
+                f'DELETE FROM {table} where request_id in (select request_id from _outdated_requests)'
+            ))
+        request_features.to_sql(request_table, connection, if_exists='append', index=False, chunksize=chunk_size)
+        option_features.to_sql(option_table, connection, if_exists='append', index=False, chunksize=chunk_size)
+        connection.execute(text(
+            f"""
+                INSERT INTO {state_table} (request_id, rows_hash)
+                SELECT c.request_id, c.rows_hash
+                FROM _request_hashes c
+                join _changed_requests using (request_id)
+            """
+        ))
+    logging.info('%s features refreshed: %r options', table_prefix, len(option_features))
+    return changed_count
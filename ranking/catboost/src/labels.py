@@ -0,0 +1,69 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+from ranking.catboost.src.dedup import option_class_keys
+
+# option is a flight of a sent option (0031_filters_for_pairs.sql)
+SENT_FLIGHT_COLUMNS = ['requestid', 'fligtoption']
+# option is the cheapest one of a sent option with the same flight, class and flags (0029_post_final_features.sql)
+SENT_OPTION_COLUMNS = ['requestid', 'fligtoption', 'class', 'isbaggage', 'isrefundpermitted', 'isexchangepermitted']
+LABEL_INPUTS = {
+    'sentoption_flight': SENT_FLIGHT_COLUMNS + ['sentoption'],
+    'sentoption_fixed': SENT_OPTION_COLUMNS + ['sentoption', 'same_options_best_price'],
+}
+
+
+def flag_mask(column: pd.Series, flag: bool) -> np.ndarray:
+    """
+    rows where the nullable bool column holds exactly `flag` (nulls never match)
+    """
+    return column.eq(flag).fillna(False).to_numpy(dtype=bool)
+
+
+def _any_in_group(data: pd.DataFrame, key_columns: list[str], flags: np.ndarray) -> np.ndarray:
+    """
+    rows whose key group has a flagged row; rows with a null key column match nothing,
+    as with the equality join of the sql
+    """
+    codes, uniques = pd.factorize(option_class_keys(data, key_columns))
+    flagged_groups = np.bincount(codes[flags], minlength=len(uniques)) > 0
+    has_null_key = data[key_columns].isna().any(axis=1).to_numpy()
+    return flagged_groups[codes] & ~has_null_key
+
+
+def sentoption_flight(data: pd.DataFrame) -> np.ndarray:
+    return _any_in_group(data, SENT_FLIGHT_COLUMNS, flag_mask(data['sentoption'], True))
+
+
+def sentoption_fixed(data: pd.DataFrame) -> np.ndarray:
+    return (
+        _any_in_group(data, SENT_OPTION_COLUMNS, flag_mask(data['sentoption'], True))
+        & flag_mask(data['same_options_best_price'], True)
+    )
+
+
+LABELS = {
+    'sentoption_flight': sentoption_flight,
+    'sentoption_fixed': sentoption_fixed,
+}
+
+
+def add_labels(data: pd.DataFrame, labels: list[str]) -> pd.DataFrame:
+    """
+    compute labels from their inputs in memory: linear in rows, no self joins and no locks on db tables;
+    labels with absent inputs (final_test has no sentoption) are skipped
+
+    :param data: rows of whole requests
+    """
+    computed = {
+        label: LABELS[label](data)
+        for label in labels
+        if all(column in data.columns for column in LABEL_INPUTS[label])
+    }
+    if not computed:
+        return data
+    logging.info('Labels computed: %s', ', '.join(f'{label}={mask.sum()}' for label, mask in computed.items()))
+    return data.assign(**computed)
+
@@ -1,12 +1,48 @@
+import asyncio
+import functools
+import hashlib
+import inspect
 import logging
-from collections import defaultdict
+import re
+from collections.abc import Iterator
+from pathlib import Path
 
+import numpy as np
 import pandas as pd
+import sqlalchemy
+from catboost import Pool
 from sqlalchemy import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from ranking.catboost.src.async_loader import read_sql_async, write_scores_async
+from ranking.catboost.src.cache import FeatureCache, table_fingerprint
+from ranking.catboost.src.compact import compact_frame, feature_matrix, features_frame, untyped_columns
+from ranking.catboost.src.feature_store import FeatureStore
+from ranking.catboost.src.features import compute_columns
+from ranking.catboost.src.group_kernels import rank
+from ranking.catboost.src.groups import RequestGroups
+from ranking.catboost.src.labels import LABEL_INPUTS, add_labels, flag_mask
+from ranking.catboost.src.loader import read_copy, stream_query
+from ranking.catboost.src.locations import LocationResolver
+from ranking.catboost.src.metrics import LABEL_PREFIXES, TOP_K, RankScoreMetric, ranking_metrics
+from ranking.catboost.src.pairs import build_pairs, iter_pairs, write_pairs_file
+from ranking.catboost.src.pool_cache import PoolCache
 
 logging.getLogger().setLevel(logging.INFO)
 
 
+@functools.cache
+def code_version() -> str:
+    """
+    hash of sources of modules prepared data and learn pools are made by (this one, labels, compact,
+    loader, pairs): cached features and pools of changed code get new keys
+    """
+    digest = hashlib.sha256()
+    for function in [code_version, add_labels, compact_frame, read_copy, build_pairs]:
+        digest.update(inspect.getsource(inspect.getmodule(function)).encode())
+    return digest.hexdigest()
+
+
 class PreparedResult:
     def __init__(
             self,
@@ -14,15 +50,55 @@ class PreparedResult:
             target_column: list[str],
             features_columns: list[str],
             text_features: list[str] | None = None,
+            compact: bool = False,
     ):
-        self.data: pd.DataFrame = data
+        """
+        :param compact: keep data in compact dtypes (float32, nullable bool, category)
+            and cache features frame / matrix built on first access
+        """
         self.target_column: list[str] = target_column
         self.features_columns: list[str] = features_columns
         self.text_features: list[str] = text_features or []
+        self.compact: bool = compact
+        if compact:
+            data = compact_frame(data, categorical_columns=self.text_features, keep_columns=target_column)
+        self.data: pd.DataFrame = data
+        self._feature_matrix: np.ndarray | None = None
+        self._features_frame: pd.DataFrame | None = None
+        self._groups: RequestGroups | None = None
+
+    @property
+    def numeric_features_columns(self) -> list[str]:
+        return [col for col in self.features_columns if col not in self.text_features]
+
+    @property
+    def feature_matrix(self) -> np.ndarray:
+        """
+        C-contiguous float32 matrix of not text features (nulls as NaN)
+        """
+        if self._feature_matrix is not None:
+            return self._feature_matrix
+        matrix = feature_matrix(self.data, self.numeric_features_columns)
+        if self.compact:
+            self._feature_matrix = matrix
+        return matrix
 
     @property
     def features_frame(self):
-        return self.data[self.features_columns]
+        """
+        features with not text ones as one float32 block (nullable bools as 0/1/NaN for CatBoost)
+        """
+        if self._features_frame is not None:
+            return self._features_frame
+        frame = features_frame(
+            self.data,
+            self.features_columns,
+            self.text_features,
+            self.feature_matrix,
+        )
+        if self.compact:
+            self._features_frame = frame
+        return frame
 
     @property
     def target_frame(self):
@@ -32,56 +108,515 @@ class PreparedResult:
     def request_id_frame(self):
         return self.data[['requestid']]
 
-    def make_pairs(self):
-        result = []
-        request_stat = {}
-        for pos, rec in self.data.iterrows():
-            request_stat.setdefault(
-                rec['requestid'],
-                {
-                    'recs_from_sent_flights': {},
-                    'trash_recs': [],
-                }
-            )
-            if rec['sentoption_flight'] is False:
-                request_stat[rec['requestid']]['trash_recs'].append(pos)
-            else:
-                request_stat[rec['requestid']]['recs_from_sent_flights'].setdefault(
-                    rec['fligtoption'],
-                    defaultdict(list),
-                )
-                variants = request_stat[rec['requestid']]['recs_from_sent_flights'][rec['fligtoption']]
-                if rec['sentoption_fixed'] is True:
-                    variants['sentoption'].append(pos)
-                else:
-                    variants['miss'].append(pos)
-        import pprint
-        for request_info in request_stat.values():
-            for sentoption_flight_info in request_info['recs_from_sent_flights'].values():
-                for win_pos in sentoption_flight_info.get('sentoption', []) :
-                    for loos_pos in sentoption_flight_info.get('miss', []):
-                        result.append([win_pos, loos_pos])
-                    for trash_pos in request_info['trash_recs']:
-                        result.append([win_pos, trash_pos])
+    @property
+    def groups(self) -> RequestGroups:
+        """
+        request index of data rows, built once and shared by pairs, group ids, ranks and metrics
+        """
+        if self._groups is None:
+            self._groups = RequestGroups(self.data['requestid'].to_numpy())
+        return self._groups
+
+    @property
+    def group_id(self) -> np.ndarray:
+        """
+        CatBoost group_id: group number of every row, rows of a request must be contiguous
+        """
+        assert self.groups.is_sorted, 'data must be ordered by requestid'
+        return self.groups.codes
+
+    def label_values(self, column: str) -> np.ndarray:
+        """
+        CatBoost label of a column: float values, null flags (nullable bool labels) as 0
+        """
+        return self.data[column].to_numpy(dtype=np.float64, na_value=0)
+
+    def rank_scores(self, scores: np.ndarray) -> np.ndarray:
+        """
+        rank() over (partition by requestid order by score desc) of model scores,
+        fixed_predict of post-processing is rank < 6
+        """
+        return rank(self.groups, [scores], descending=True)
+
+    def take_rows(self, rows: np.ndarray) -> 'PreparedResult':
+        """
+        prepared data of rows (positions in data), dtypes are kept as they are
+        """
+        result = PreparedResult(
+            data=self.data.iloc[rows].reset_index(drop=True),
+            target_column=self.target_column,
+            features_columns=self.features_columns,
+            text_features=self.text_features,
+        )
+        result.compact = self.compact
         return result
 
+    def split_requests(
+            self,
+            test_size: float = 0.1,
+            random_state: int | None = 41,
+    ) -> tuple['PreparedResult', 'PreparedResult']:
+        """
+        holdout split by requestid: all options of a request are in the same part, rows order is kept
+
+        :param test_size: share of requests in the second part
+        :return: train and test parts
+        """
+        groups_count = self.groups.groups_count
+        shuffled = np.random.default_rng(random_state).permutation(groups_count)
+        test_groups = np.zeros(groups_count, dtype=bool)
+        test_groups[shuffled[:round(groups_count * test_size)]] = True
+        in_test = self.groups.broadcast(test_groups)
+        return self.take_rows(np.flatnonzero(~in_test)), self.take_rows(np.flatnonzero(in_test))
+
+    def ranking_metrics(self, scores: np.ndarray, top_k: int = TOP_K) -> dict[str, float]:
+        """
+        post-processing metrics of scores (rank_score, top k hits) for label columns present in data
+        """
+        labels = {
+            label: flag_mask(self.data[label], True)
+            for label in LABEL_PREFIXES
+            if label in self.data.columns
+        }
+        return ranking_metrics(self.groups, scores, labels, top_k)
+
+    def make_pairs(
+            self,
+            max_trash_per_winner: int | None = None,
+            random_state: int | None = None,
+    ) -> np.ndarray:
+        """
+        pairs [winner_pos, loser_pos] for PairLogit: sentoption_fixed option beats
+        other options of the same sent flight and all options of not sent flights of the request
+
+        :param max_trash_per_winner: cap pairs with not sent flights options per winner
+        :param random_state: seed to choose capped options at random, None for the first ones
+        """
+        return build_pairs(self.data, max_trash_per_winner, random_state, self.groups)
+
+    def iter_pairs(
+            self,
+            chunk_size: int = 1_000_000,
+            max_trash_per_winner: int | None = None,
+            random_state: int | None = None,
+    ) -> Iterator[np.ndarray]:
+        return iter_pairs(self.data, chunk_size, max_trash_per_winner, random_state, self.groups)
+
+    def write_pairs(
+            self,
+            path: str | Path,
+            max_trash_per_winner: int | None = None,
+            random_state: int | None = None,
+    ) -> int:
+        return write_pairs_file(
+            self.data,
+            path,
+            max_trash_per_winner=max_trash_per_winner,
+            random_state=random_state,
+            groups=self.groups,
+        )
+
 
 class AbstractTrainFlow:
     model_name: str
+    # columns of {table_prefix}_requests, {table_prefix}_requests_features and support scores tables
+    target: list[str] = []
+    exclude_but_keep: list[str] = ['id']
+    num_features: list[str] = []
+    bool_features: list[str] = []
+    text_features: list[str] = []
+    support_model_scores_table: str | None = None
+    # prefixes of requests the support model scores were computed for (final_test ones in a _final_test table)
+    support_scores_prefixes: tuple[str, ...] = ('agent',)
+    compact: bool = False
+    # labels computed in memory from their inputs (labels.LABEL_INPUTS) instead of reading db columns
+    computed_labels: list[str] = []
+
+    # early stopping by RankScoreMetric on a holdout of requests, None to learn all iterations without eval set
+    early_stopping_rounds: int | None = None
+    eval_requests_share: float = 0.1
+    eval_metric_kind: str = 'rank_score'
 
-    def __init__(self, db_engine: Engine, sampling_table_name: str | None = None):
+    def __init__(
+            self,
+            db_engine: Engine,
+            sampling_table_name: str | None = None,
+            feature_cache: FeatureCache | None = None,
+            copy_export: bool = False,
+            pool_cache: PoolCache | None = None,
+    ):
+        """
+        :param feature_cache: local cache of prepare_features results, None to always read from db
+        :param copy_export: read prepare_features data with COPY TO STDOUT bulk export (postgres only)
+        :param pool_cache: local cache of quantized learn pools, None to build pools in memory on every learn
+        """
         self.db_engine: Engine = db_engine
         self.sampling_table_name = sampling_table_name
+        self.feature_cache: FeatureCache | None = feature_cache
+        self.copy_export: bool = copy_export
+        self.pool_cache: PoolCache | None = pool_cache
         self.model = None
+        self._table_columns_cache: dict[str, set[str]] = {}
 
-    def prepare_features(self, limit: int | None = None) -> PreparedResult:
+    def prepare_features(
+            self,
+            limit: int | None = None,
+            filter_for_test: bool = False,
+            table_prefix: str = 'agent',
+            for_test: bool = False,
+    ) -> PreparedResult:
         """
         do operations to prepare and extract features for learn
 
         :param limit: limit data size to read from db for smock check learn run
+        :param filter_for_test: read only train part of sampling table
+        :param table_prefix: agent, client or final_test tables
+        :param for_test: with filter_for_test read the test part of sampling table instead (a labeled holdout)
         :return:
         """
-        raise NotImplementedError
+        select_query = self.select_query(limit, filter_for_test, table_prefix, for_test)
+        if self.feature_cache is None:
+            return self.prepare_data(self.read_data(select_query))
+
+        key = self.feature_cache.make_key(
+            flow=f'{type(self).__module__}.{type(self).__qualname__}',
+            flow_source=self._source_hash(),
+            code_version=code_version(),
+            model_name=self.model_name,
+            query=select_query,
+            limit=limit,
+            filter_for_test=filter_for_test,
+            table_prefix=table_prefix,
+            for_test=for_test,
+            sampling_table_name=self.sampling_table_name,
+            fingerprint=table_fingerprint(self.db_engine, self.source_tables(filter_for_test, table_prefix)),
+        )
+        cached = self.feature_cache.load(key)
+        if cached is not None:
+            data, meta = cached
+            return PreparedResult(data=data, **meta)
+
+        prepared = self.prepare_data(self.read_data(select_query))
+        self.feature_cache.save(
+            key,
+            prepared.data,
+            {
+                'target_column': prepared.target_column,
+                'features_columns': prepared.features_columns,
+                'text_features': prepared.text_features,
+                'compact': prepared.compact,
+            },
+        )
+        return prepared
+
+    def read_data(self, select_query: str) -> pd.DataFrame:
+        if self.copy_export:
+            train_data = read_copy(self.db_engine, select_query, dtype=self.column_dtypes)
+        else:
+            train_data = pd.read_sql(select_query, self.db_engine, dtype=self.column_dtypes)
+        logging.info('Data select done')
+        return train_data
+
+    def _source_hash(self) -> str | None:
+        try:
+            return hashlib.sha256(inspect.getsource(type(self)).encode()).hexdigest()
+        except OSError:
+            return None
+
+    def support_scores_table(self, table_prefix: str = 'agent') -> str | None:
+        if self.support_model_scores_table is None:
+            return None
+        if table_prefix not in self.support_scores_prefixes:
+            # joined by id, scores of another prefix belong to other rows
+            raise NotImplementedError(f'{self.model_name} has no support scores of {table_prefix} requests')
+        return self.support_model_scores_table + ('_final_test' if table_prefix == 'final_test' else '')
+
+    def source_tables(self, filter_for_test: bool = False, table_prefix: str = 'agent') -> list[str]:
+        """
+        tables read by select_query, in order of columns lookup
+        """
+        assert re.match("^[a-z0-9_]*$", table_prefix)
+        tables = [f'{table_prefix}_requests', f'{table_prefix}_requests_features']
+        support_table = self.support_scores_table(table_prefix)
+        if support_table is not None:
+            tables.append(support_table)
+        if filter_for_test:
+            assert isinstance(self.sampling_table_name, str)
+            assert re.match("^[a-z0-9_]*$", self.sampling_table_name)
+            tables.append(self.sampling_table_name)
+        return tables
+
+    @property
+    def used_columns(self) -> list[str]:
+        columns = (
+            ['requestid'] + self.exclude_but_keep + self.target
+            + self.num_features + self.bool_features + self.text_features
+        )
+        columns = [column for column in columns if column not in self.computed_labels]
+        label_inputs = [column for label in self.computed_labels for column in LABEL_INPUTS[label]]
+        return list(dict.fromkeys(columns + label_inputs))
+
+    @property
+    def column_dtypes(self) -> dict[str, str]:
+        """
+        dtypes applied at fetch time: numeric features as floats (casted from numeric in db),
+        bool features as nullable boolean
+        """
+        float_dtype = 'float32' if self.compact else 'float64'
+        return {
+            **{column: float_dtype for column in self.num_features},
+            **{column: 'boolean' for column in self.bool_features},
+        }
+
+    def _table_columns(self, table: str) -> set[str]:
+        if table not in self._table_columns_cache:
+            self._table_columns_cache[table] = {
+                column['name'] for column in sqlalchemy.inspect(self.db_engine).get_columns(table)
+            }
+        return self._table_columns_cache[table]
+
+    def select_query(
+            self,
+            limit: int | None = None,
+            filter_for_test: bool = False,
+            table_prefix: str = 'agent',
+            for_test: bool = False,
+    ) -> str:
+        """
+        query of prepare_features data, ordered by requestid: only used columns,
+        each one taken from the first of source tables having it;
+        target and kept columns may be absent (final_test has no sentoption)
+
+        :param for_test: part of sampling table to read with filter_for_test
+        """
+        requests_table = f'{table_prefix}_requests'
+        tables = self.source_tables(filter_for_test=False, table_prefix=table_prefix)
+        predictors = self.num_features + self.bool_features + self.text_features
+        select_columns = []
+        for column in self.used_columns:
+            table = next((table for table in tables if column in self._table_columns(table)), None)
+            if table is None:
+                assert column not in predictors, f'column {column} not found in {tables}'
+                continue
+            if column in self.num_features:
+                # numeric(16, 2) / decimal(6, 2) would be fetched as python Decimal objects
+                select_columns.append(f'CAST({table}."{column}" AS double precision) AS "{column}"')
+            else:
+                select_columns.append(f'{table}."{column}"')
+
+        joins = [
+            f'join {table} on {table}.id = {requests_table}.id'
+            for table in tables[1:]
+        ]
+        if filter_for_test:
+            assert isinstance(self.sampling_table_name, str)
+            assert re.match("^[a-z0-9_]*$", self.sampling_table_name)
+            joins.append(f'join {self.sampling_table_name} a on {requests_table}.id = a.id and for_test={for_test}')
+        select_query = (
+            f'SELECT {", ".join(select_columns)}\n'
+            f'FROM {requests_table}\n'
+            + ''.join(f'{join}\n' for join in joins)
+            + f'order by {requests_table}.requestid'
+        )
+        if limit is not None:
+            assert isinstance(limit, int)
+            select_query += f'\nLIMIT {limit}'
+        return select_query
+
+    def prepare_data(self, train_data: pd.DataFrame) -> PreparedResult:
+        """
+        select features from loaded data
+        """
+        train_data = add_labels(train_data, self.computed_labels)
+        used = self.target + self.num_features + self.bool_features + self.exclude_but_keep + self.text_features
+        predictors = self.num_features + self.bool_features + self.text_features
+        prepared_data = train_data.drop(columns=[col for col in train_data.columns if col not in used])
+        untyped = untyped_columns(prepared_data, allowed=self.text_features + self.target + self.exclude_but_keep)
+        assert not untyped, f'object columns in features: {untyped}'
+        logging.info('Data prepared')
+
+        return PreparedResult(
+            data=prepared_data,
+            target_column=self.target,
+            features_columns=predictors,
+            text_features=self.text_features,
+            compact=self.compact,
+        )
+
+    def prepare_raw(
+            self,
+            raw: pd.DataFrame,
+            locations: LocationResolver,
+            table_prefix: str = 'agent',
+    ) -> PreparedResult:
+        """
+        prepare_features from raw option rows (features.read_raw_requests) without feature tables:
+        only features of used_columns and their dependencies are computed
+
+        :param raw: rows ordered by requestid, with the target and kept columns that are not features
+        """
+        data = compute_columns(raw, locations, self.used_columns, table_prefix)
+        dtypes = {column: dtype for column, dtype in self.column_dtypes.items() if column in data.columns}
+        return self.prepare_data(data.astype(dtypes))
+
+    def prepare_stored(self, store: FeatureStore, version: str, dates: list[str] | None = None) -> PreparedResult:
+        """
+        prepare_features from a feature store version: the exact features a model was trained on
+        """
+        data = store.read(version, self.used_columns, dates)
+        dtypes = {column: dtype for column, dtype in self.column_dtypes.items() if column in data.columns}
+        return self.prepare_data(data.astype(dtypes))
+
+    async def prepare_features_async(
+            self,
+            async_engine: AsyncEngine,
+            limit: int | None = None,
+            filter_for_test: bool = False,
+            table_prefix: str = 'agent',
+    ) -> PreparedResult:
+        """
+        prepare_features over async engine pool, so several of them can wait for db concurrently
+        """
+        select_query = await asyncio.to_thread(self.select_query, limit, filter_for_test, table_prefix)
+        train_data = await read_sql_async(async_engine, select_query, dtype=self.column_dtypes)
+        return await asyncio.to_thread(self.prepare_data, train_data)
+
+    def iter_prepare_features(
+            self,
+            limit: int | None = None,
+            filter_for_test: bool = False,
+            table_prefix: str = 'agent',
+            chunk_rows: int = 100_000,
+    ) -> Iterator[PreparedResult]:
+        """
+        prepare_features by chunks read with server side cursor, each request is whole in one chunk;
+        next chunks are read and prepared in background while the caller processes the current one
+
+        :param chunk_rows: approximate rows count of chunk
+        """
+        return stream_query(
+            self.db_engine,
+            self.select_query(limit, filter_for_test, table_prefix),
+            self.prepare_data,
+            chunk_rows=chunk_rows,
+            dtype=self.column_dtypes,
+        )
+
+    def learn_pool_params(self, loss_function: str | None = None) -> dict:
+        """
+        what the learn pool is made of: label column and make_pairs params (None for pools without pairs)
+
+        :param loss_function: loss the pool is learned with, None for the one of the flow model
+        """
+        return {'label_column': self.target[0], 'pairs': None}
+
+    def cached_pool_key(
+            self,
+            prepared_data: PreparedResult,
+            pool_cache: PoolCache | None = None,
+            loss_function: str | None = None,
+            **quantization,
+    ) -> str:
+        """
+        key of the learn pool in pool_cache (self.pool_cache by default), the pool is quantized and saved on first call
+
+        :param loss_function: loss to make the pool for (learn_pool_params)
+        """
+        pool_cache = pool_cache or self.pool_cache
+        assert pool_cache is not None
+        params = self.learn_pool_params(loss_function)
+        key = pool_cache.make_key(
+            prepared_data.data,
+            features_columns=prepared_data.features_columns,
+            text_features=prepared_data.text_features,
+            quantization=quantization,
+            code_version=code_version(),
+            **params,
+        )
+        if pool_cache.pool_path(key).exists():
+            return key
+        # pairs go to the file only, the pool is quantized without them
+        pool = Pool(
+            prepared_data.features_frame,
+            label=prepared_data.label_values(params['label_column']),
+            cat_features=prepared_data.text_features,
+            group_id=prepared_data.group_id,
+        )
+        pool.quantize(**quantization)
+        pairs = params['pairs']
+        pool_cache.save(
+            key,
+            pool,
+            write_pairs=None if pairs is None else lambda path: prepared_data.write_pairs(path, **pairs),
+        )
+        return key
+
+    def learn_pool(self, prepared_data: PreparedResult, **quantization) -> Pool:
+        """
+        CatBoost pool of prepared data with group ids and pairs of learn_pool_params;
+        with pool_cache it is quantized once and later learns on the same features load it from disk
+
+        :param quantization: Pool.quantize params (border_count, feature_border_type, ...),
+            used with pool_cache only: model border params do not apply to quantized pools
+        """
+        if self.pool_cache is not None:
+            return self.pool_cache.load(self.cached_pool_key(prepared_data, **quantization))
+        return self.raw_pool(prepared_data)
+
+    def raw_pool(self, prepared_data: PreparedResult) -> Pool:
+        """
+        not quantized pool of learn_pool_params, also the eval set of cached learn pools:
+        an eval pool quantized on its own would get borders of its own, not the learn pool ones
+        """
+        params = self.learn_pool_params()
+        pairs = None
+        if params['pairs'] is not None:
+            pairs = prepared_data.make_pairs(**params['pairs'])
+            logging.info('Pairs: %r', len(pairs))
+        return Pool(
+            prepared_data.features_frame,
+            label=prepared_data.label_values(params['label_column']),
+            pairs=pairs,
+            cat_features=prepared_data.text_features,
+            group_id=prepared_data.group_id,
+        )
+
+    def eval_metric(self, eval_data: PreparedResult) -> RankScoreMetric:
+        """
+        post-processing metric of eval_data sent options (the first target column)
+        """
+        return RankScoreMetric(
+            eval_data.groups,
+            flag_mask(eval_data.data[self.target[0]], True),
+            kind=self.eval_metric_kind,
+        )
+
+    def fit_model(self, model, prepared_data: PreparedResult):
+        """
+        fit model on learn_pool; with early_stopping_rounds eval_requests_share of requests is held out
+        and learning stops when the post-processing metric on them stops improving (the best iteration is kept)
+        """
+        if self.early_stopping_rounds is None:
+            model.fit(self.learn_pool(prepared_data))
+            return model
+        train_data, eval_data = prepared_data.split_requests(self.eval_requests_share)
+        eval_metric = self.eval_metric(eval_data)
+        model.set_params(eval_metric=eval_metric)
+        eval_pool = self.raw_pool(eval_data)
+        # group weights: pairwise losses do not take object weights
+        eval_pool.set_group_weight(eval_metric.eval_weights())
+        model.fit(
+            self.learn_pool(train_data),
+            eval_set=eval_pool,
+            early_stopping_rounds=self.early_stopping_rounds,
+            use_best_model=True,
+        )
+        logging.info(
+            'Early stopping: best iteration %r of %r, %s %r',
+            model.get_best_iteration(), model.get_param('iterations'), self.eval_metric_kind,
+            model.get_best_score().get('validation'),
+        )
+        return model
 
     def learn(self, prepared_data: PreparedResult):
         raise NotImplementedError
@@ -97,3 +632,39 @@ class AbstractTrainFlow:
 
     def apply_model_in_db(self):
         raise NotImplementedError
+
+    def result_table_name(self, table_prefix: str = 'agent') -> str:
+        suffix = {'agent': '', 'client': '_client', 'final_test': '_final_test'}[table_prefix]
+        return f"{self.model_name}{suffix}"
+
+    def predict_scores(self, prepared_data: PreparedResult) -> tuple[np.ndarray, np.ndarray]:
+        """
+        :return: bool predicts and float scores of model for prepared_data rows
+        """
+        raise NotImplementedError
+
+    async def apply_model_in_db_async(self, async_engine: AsyncEngine, table_prefix: str = 'agent'):
+        """
+        apply_model_in_db over async engine: load, predict (in a worker thread) and write results
+        """
+        assert self.model is not None
+        data = await self.prepare_features_async(async_engine, table_prefix=table_prefix)
+        predicts, scores = await asyncio.to_thread(self.predict_scores, data)
+        logging.info('%s predicts calculated for %s', self.model_name, table_prefix)
+        await write_scores_async(
+            async_engine,
+            self.result_table_name(table_prefix),
+            data.data['id'].to_numpy(),
+            predicts,
+            scores,
+        )
+
+
+async def apply_models_in_db_async(
+        async_engine: AsyncEngine,
+        jobs: list[tuple[AbstractTrainFlow, str]],
+):
+    """
+    apply (flow, table_prefix) jobs concurrently, total time is about the time of the slowest job
+    """
+    await asyncio.gather(*(flow.apply_model_in_db_async(async_engine, table_prefix) for flow, table_prefix in jobs))
@@ -0,0 +1,188 @@
+import logging
+import os
+import queue
+import threading
+from collections.abc import Callable, Iterator
+from typing import TypeVar
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+from sqlalchemy import Engine, text
+
+T = TypeVar('T')
+
+_DONE = object()
+
+
+def split_last_group(frame: pd.DataFrame, key: str) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    split frame ordered by key into (complete groups, rows of the last key value)
+    """
+    keys = frame[key].to_numpy()
+    other = np.flatnonzero(keys != keys[-1])
+    split = other[-1] + 1 if len(other) else 0
+    return frame.iloc[:split], frame.iloc[split:]
+
+
+def iter_request_chunks(
+        engine: Engine,
+        query: str,
+        chunk_rows: int = 100_000,
+        key: str = 'requestid',
+        dtype: dict[str, str] | None = None,
+) -> Iterator[pd.DataFrame]:
+    """
+    read query result with server side cursor by chunks of about chunk_rows rows,
+    never splitting rows of one key value between chunks
+
+    :param query: select ordered by key
+    :param dtype: column dtypes applied to each fetched chunk
+    :return: frames with fresh RangeIndex
+    """
+    tail: pd.DataFrame | None = None
+    last_key = None
+    with engine.connect().execution_options(stream_results=True, max_row_buffer=chunk_rows) as connection:
+        # the driver wraps query into DECLARE ... CURSOR FOR <query>
+        for frame in pd.read_sql(text(query.strip().rstrip(';')), connection, chunksize=chunk_rows, dtype=dtype):
+            if len(frame) == 0:
+                continue
+            keys = frame[key].to_numpy()
+            assert (last_key is None or keys[0] >= last_key) and (keys[1:] >= keys[:-1]).all(), \
+                f'query must be ordered by {key}'
+            last_key = keys[-1]
+            if tail is not None:
+                frame = pd.concat([tail, frame], ignore_index=True)
+            complete, tail = split_last_group(frame, key)
+            if len(complete):
+                yield complete.reset_index(drop=True)
+    if tail is not None and len(tail):
+        yield tail.reset_index(drop=True)
+
+
+def prefetch(items: Iterator[T], depth: int = 2) -> Iterator[T]:
+    """
+    produce items in a background thread, keeping up to depth ready items ahead of the consumer,
+    so network reads overlap with processing of already received chunks
+    """
+    ready: queue.Queue = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                ready.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put(item):
+                    return
+            put(_DONE)
+        except BaseException as error:  # re-raised in consumer thread
+            put(error)
+        finally:
+            close = getattr(items, 'close', None)
+            if close is not None:
+                close()
+
+    worker = threading.Thread(target=produce, name='prefetch', daemon=True)
+    worker.start()
+    try:
+        while True:
+            item = ready.get()
+            if item is _DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        worker.join(timeout=1)
+
+
+def stream_query(
+        engine: Engine,
+        query: str,
+        prepare: Callable[[pd.DataFrame], T],
+        chunk_rows: int = 100_000,
+        key: str = 'requestid',
+        depth: int = 2,
+        dtype: dict[str, str] | None = None,
+) -> Iterator[T]:
+    """
+    request aligned chunks of query result converted by `prepare` in the background reader thread
+    """
+    def prepared_chunks():
+        for pos, chunk in enumerate(iter_request_chunks(engine, query, chunk_rows, key, dtype)):
+            logging.info('chunk %r read: %r rows', pos, len(chunk))
+            yield prepare(chunk)
+
+    return prefetch(prepared_chunks(), depth)
+
+
+def read_copy(
+        engine: Engine,
+        query: str,
+        dtype: dict[str, str] | None = None,
+        block_size: int = 16 * 2 ** 20,
+) -> pd.DataFrame:
+    """
+    bulk read with `COPY (query) TO STDOUT` in csv format: the server streams rows without per-row
+    protocol overhead and pyarrow decodes the stream into columns in parallel while it arrives
+
+    Only for postgres (psycopg2) engines. Compression is done by the ssh tunnel (compression=True)
+    as plain COPY TO STDOUT can not compress on the server side.
+
+    :param dtype: column dtypes, float and bool ones are parsed directly into typed arrays
+    """
+    dtype = dtype or {}
+    arrow_types = {
+        column: pa.from_numpy_dtype(np.dtype(column_dtype)) if column_dtype != 'boolean' else pa.bool_()
+        for column, column_dtype in dtype.items()
+    }
+    copy_sql = f"COPY ({query.strip().rstrip(';')}) TO STDOUT WITH (FORMAT csv, HEADER true)"
+    read_fd, write_fd = os.pipe()
+    errors: list[BaseException] = []
+
+    def copy_to_pipe():
+        try:
+            with os.fdopen(write_fd, 'wb') as pipe:
+                connection = engine.raw_connection()
+                try:
+                    with connection.cursor() as cursor:
+                        cursor.copy_expert(copy_sql, pipe)
+                finally:
+                    connection.close()
+        except BaseException as error:  # re-raised in caller thread
+            errors.append(error)
+
+    writer = threading.Thread(target=copy_to_pipe, name='copy', daemon=True)
+    writer.start()
+    try:
+        with os.fdopen(read_fd, 'rb') as pipe:
+            table = pa_csv.read_csv(
+                pipe,
+                read_options=pa_csv.ReadOptions(block_size=block_size),
+                convert_options=pa_csv.ConvertOptions(
+                    column_types=arrow_types,
+                    true_values=['t'],
+                    false_values=['f'],
+                    null_values=[''],
+                    strings_can_be_null=True,
+                    quoted_strings_can_be_null=False,
+                ),
+            )
+    finally:
+        # closed pipe stops the writer if parsing failed, the parsing error is more relevant then
+        writer.join()
+        if errors and not isinstance(errors[0], BrokenPipeError):
+            raise errors[0]
+    frame = table.to_pandas(types_mapper={pa.bool_(): pd.BooleanDtype()}.get)
+    logging.info('copy read: %r rows, %.1f MB', len(frame), table.nbytes / 2 ** 20)
+    return frame
@@ -0,0 +1,99 @@
+import logging
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import Connection, Engine
+
+LETTERS = 26
+DENSE_SIZE = LETTERS ** 3
+
+
+def read_locations(engine: Engine | Connection) -> pd.DataFrame:
+    """
+    city of every iata code (airport or city one): timezone, countrycode, city iatacode; indexed by code
+    """
+    return pd.read_sql(
+        """
+        SELECT iata_codes.code, cities.timezone, cities.countrycode, cities.iatacode
+        FROM iata_codes
+        join cities on iata_codes.city_id = cities.id
+        """,
+        engine,
+        dtype={'timezone': 'float64'},
+        index_col='code',
+    )
+
+
+def _dense_slots(codes: np.ndarray) -> np.ndarray:
+    """
+    slot of every 3 latin letters code in the 26^3 array, -1 for other codes (cyrillic, digits, nulls)
+    """
+    codes = pd.Series(codes, dtype=object)
+    latin = codes.str.fullmatch('[A-Z]{3}').fillna(False).to_numpy(dtype=bool)
+    slots = np.full(len(codes), -1, dtype=np.int64)
+    if latin.any():
+        letters = np.frombuffer(codes[latin].to_numpy(dtype='S3').tobytes(), dtype=np.uint8).reshape(-1, 3)
+        letters = letters.astype(np.int64) - ord('A')
+        slots[latin] = (letters[:, 0] * LETTERS + letters[:, 1]) * LETTERS + letters[:, 2]
+    return slots
+
+
+class LocationResolver:
+    """
+    iata_codes -> cities reference data in arrays: 3 latin letters codes index a dense 26^3 array
+    of row numbers, other codes (internal cyrillic ones) go to an overflow dict.
+    Codes of a column are resolved once per distinct value and gathered for all rows.
+    """
+
+    def __init__(self, locations: pd.DataFrame):
+        """
+        :param locations: frame of read_locations, indexed by code
+        """
+        codes = locations.index.to_numpy(dtype=object)
+        # the last row is for unknown codes (row -1): nulls
+        self.timezone: np.ndarray = np.append(
+            locations['timezone'].to_numpy(dtype=np.float64, na_value=np.nan),
+            np.nan,
+        )
+        self.countrycode: np.ndarray = np.append(locations['countrycode'].to_numpy(dtype=object), None)
+        self.iatacode: np.ndarray = np.append(locations['iatacode'].to_numpy(dtype=object), None)
+
+        slots = _dense_slots(codes)
+        self.dense: np.ndarray = np.full(DENSE_SIZE, -1, dtype=np.int32)
+        self.dense[slots[slots >= 0]] = np.flatnonzero(slots >= 0)
+        self.overflow: dict[str, int] = {
+            code: row for row, code in enumerate(codes) if slots[row] < 0 and code is not None
+        }
+        logging.info('Locations loaded: %r latin codes, %r other codes', (slots >= 0).sum(), len(self.overflow))
+
+    @classmethod
+    def from_db(cls, engine: Engine | Connection) -> 'LocationResolver':
+        return cls(read_locations(engine))
+
+    def rows(self, codes: pd.Series | np.ndarray) -> np.ndarray:
+        """
+        reference row of every code, -1 for unknown and null codes
+        """
+        value_codes, uniques = pd.factorize(np.asarray(codes, dtype=object))
+        uniques = np.asarray(uniques, dtype=object)
+        slots = _dense_slots(uniques)
+        unique_rows = np.where(slots >= 0, self.dense[np.maximum(slots, 0)], -1)
+        for pos in np.flatnonzero(slots < 0):
+            unique_rows[pos] = self.overflow.get(uniques[pos], -1)
+        # null codes (-1) take the appended unknown row, also when there are no codes at all
+        return np.append(unique_rows, -1)[value_codes]
+
+    def resolve(self, codes: pd.Series | np.ndarray) -> pd.DataFrame:
+        """
+        :return: known (code is in iata_codes with a city), timezone, countrycode, iatacode of city
+        """
+        rows = self.rows(codes)
+        result = pd.DataFrame({
+            'known': rows >= 0,
+            'timezone': self.timezone[rows],
+            'countrycode': self.countrycode[rows],
+            'iatacode': self.iatacode[rows],
+        })
+        if isinstance(codes, pd.Series):
+            result.index = codes.index
+        return result
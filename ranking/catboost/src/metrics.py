@@ -0,0 +1,101 @@
+import numpy as np
+
+from ranking.catboost.src.group_kernels import rank
+from ranking.catboost.src.groups import RequestGroups
+
+# fixed_predict of post-processing: rank < 6
+TOP_K = 5
+# label column -> prefix of its metrics in postprocess_model_0xx selects
+LABEL_PREFIXES = {
+    'sentoption': '',
+    'sentoption_fixed': 'f_',
+}
+
+
+def label_metrics(ranks: np.ndarray, sent: np.ndarray, top_k: int = TOP_K) -> dict[str, float]:
+    """
+    metrics of 0032_experiment_016_result.sql for one label
+
+    :param ranks: rank() over score desc within request
+    :param sent: rows of sent options
+    :return: rank_score (sum of ranks of sent options, lower is better), sentoption_miss (sent out of top k),
+        positive_success_count (sent in top k), sentoption_count, positive_count (rows in top k), precision, recall
+    """
+    sent = np.asarray(sent, dtype=bool)
+    predicted = ranks <= top_k
+    hits = int(np.count_nonzero(predicted & sent))
+    sent_count = int(np.count_nonzero(sent))
+    positive_count = int(np.count_nonzero(predicted))
+    return {
+        'rank_score': int(ranks[sent].sum()),
+        'sentoption_miss': sent_count - hits,
+        'positive_success_count': hits,
+        'sentoption_count': sent_count,
+        'positive_count': positive_count,
+        'precision': hits / positive_count if positive_count else np.nan,
+        'recall': hits / sent_count if sent_count else np.nan,
+    }
+
+
+def ranking_metrics(
+        groups: RequestGroups,
+        scores: np.ndarray,
+        labels: dict[str, np.ndarray],
+        top_k: int = TOP_K,
+) -> dict[str, float]:
+    """
+    post-processing metrics of model scores for every label, ranks are computed once
+
+    :param labels: label column -> sent rows (sentoption, sentoption_fixed)
+    :return: metrics named as in postprocess selects: rank_score, f_rank_score, ...; requests count
+    """
+    ranks = rank(groups, [scores], descending=True)
+    result = {'requests': groups.groups_count}
+    for label, sent in labels.items():
+        prefix = LABEL_PREFIXES.get(label, f'{label}_')
+        result.update({f'{prefix}{name}': value for name, value in label_metrics(ranks, sent, top_k).items()})
+    return result
+
+
+class RankScoreMetric:
+    """
+    CatBoost eval metric of post-processing on eval set rows, vectorized (one lexsort per call):
+    rank_score (sum of score ranks of sent options, minimized) or hit_rate (share of sent options in top k)
+
+    CatBoost calls eval metrics on the learn set too and does not tell which set it is: the eval pool
+    is marked by unit object or group weights (eval_weights, they leave loss values of the eval set as they are),
+    learn pools have none; on calls without weights the metric is not computed and reported as 0.
+    """
+
+    def __init__(self, groups: RequestGroups, sent: np.ndarray, kind: str = 'rank_score', top_k: int = TOP_K):
+        """
+        :param groups: requests of eval set rows, in pool order
+        :param sent: eval set rows of sent options (target of the flow)
+        """
+        assert kind in ('rank_score', 'hit_rate')
+        self.groups: RequestGroups = groups
+        self.sent: np.ndarray = np.asarray(sent, dtype=bool)
+        self.kind: str = kind
+        self.top_k: int = top_k
+
+    def eval_weights(self) -> np.ndarray:
+        """
+        weights of the eval pool: the mark of the set the metric is computed on
+        """
+        return np.ones(self.groups.rows_count)
+
+    def is_max_optimal(self) -> bool:
+        return self.kind == 'hit_rate'
+
+    def evaluate(self, approxes, target, weight) -> tuple[float, float]:
+        if weight is None:
+            return 0.0, 1.0
+        scores = np.asarray(approxes[0], dtype=np.float64)
+        assert len(scores) == self.groups.rows_count, 'weighted pool is not the eval set of the metric'
+        metrics = label_metrics(rank(self.groups, [scores], descending=True), self.sent, self.top_k)
+        if self.kind == 'rank_score':
+            return float(metrics['rank_score']), 1.0
+        return float(metrics['positive_success_count']), float(max(metrics['sentoption_count'], 1))
+
+    def get_final_error(self, error: float, weight: float) -> float:
+        return error / weight if self.kind == 'hit_rate' else error
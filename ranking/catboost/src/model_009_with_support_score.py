@@ -1,10 +1,7 @@
 import logging
-import re
 
-import pandas as pd
 from catboost import CatBoostClassifier
 from sklearn.metrics import classification_report
-from sklearn.model_selection import train_test_split
 from sqlalchemy import Boolean, Column, Float, Integer, text
 from sqlalchemy.orm import declarative_base, sessionmaker
 from sqlalchemy.sql import insert
@@ -15,137 +12,57 @@ from ranking.catboost.src.lib import AbstractTrainFlow, PreparedResult
 class CatBoostWithSupportScoresTrainFlow9(AbstractTrainFlow):
     model_name = 'model_009_support_scores'
     support_model_scores_table = 'preprocess_scores_support_model_002_on_008'
-
-    def prepare_features(
-            self,
-            limit: int | None = None,
-            filter_for_test: bool = False,
-            table_prefix: str = 'agent',
-    ) -> PreparedResult:
-        if table_prefix == 'client':
-            raise NotImplementedError
-
-        if filter_for_test:
-            assert isinstance(self.sampling_table_name, str)
-            assert re.match("^[a-z0-9_]*$", self.sampling_table_name)
-            if limit is not None:
-                assert isinstance(limit, int)
-                select_query = f""" --sql
-                    SELECT 
-                        {table_prefix}_requests.*, 
-                        {table_prefix}_requests_features.*, 
-                        {self.support_model_scores_table}.* 
-                    FROM {table_prefix}_requests
-                    join {table_prefix}_requests_features 
-                        on {table_prefix}_requests.id = {table_prefix}_requests_features.id
-                    join {self.sampling_table_name} a on {table_prefix}_requests.id = a.id and for_test=False
-                    join {self.support_model_scores_table} 
-                        on {self.support_model_scores_table}.id = {table_prefix}_requests.id 
-                    LIMIT {limit};
-                """
-            else:
-                select_query = f"""
-                    SELECT 
-                        {table_prefix}_requests.*, 
-                        {table_prefix}_requests_features.*, 
-                        {self.support_model_scores_table}.* 
-                    FROM {table_prefix}_requests 
-                    join {table_prefix}_requests_features 
-                        on {table_prefix}_requests.id = {table_prefix}_requests_features.id
-                    join {self.support_model_scores_table} 
-                        on {self.support_model_scores_table}.id = {table_prefix}_requests.id                         
-                    join {self.sampling_table_name} a on {table_prefix}_requests.id = a.id and for_test=False;
-                """
-        else:
-            if limit is not None:
-                assert isinstance(limit, int)
-                select_query = f"""
-                    SELECT 
-                        {table_prefix}_requests.*,
-                        {table_prefix}_requests_features.*,
-                        {self.support_model_scores_table}.*
-                    FROM {table_prefix}_requests
-                    join {table_prefix}_requests_features
-                        on {table_prefix}_requests.id = {table_prefix}_requests_features.id
-                    join {self.support_model_scores_table}
-                        on {self.support_model_scores_table}.id = {table_prefix}_requests.id
-                    LIMIT {limit};
-                """
-            else:
-                select_query = f"""
-                    SELECT
-                        {table_prefix}_requests.*,
-                        {table_prefix}_requests_features.*,
-                        {self.support_model_scores_table}.*
-                    FROM {table_prefix}_requests
-                    join {table_prefix}_requests_features
-                        on {table_prefix}_requests.id = {table_prefix}_requests_features.id
-                    join {self.support_model_scores_table}
-                        on {self.support_model_scores_table}.id = {table_prefix}_requests.id                         
-                """
-
-        train_data = pd.read_sql(select_query, self.db_engine)
-        logging.info('Data select done')
-
-        target = ['sentoption']
-        exclude_but_keep = ['id']
-        num_features = [
-            'segmentcount',
-            'amount',
-            'min_price',
-            'price_diff',
-            'price_ratio',
-            'min_return_time',
-            'return_time',
-            'return_time_ratio',
-            'min_to_time',
-            'to_time',
-            'to_time_ratio',
-            'min_departure_diff_seconds',
-            'departure_diff_seconds',
-            'client_travellergrade',
-            'min_segments_count',
-            'segments_diff',
-            'departure_hour',
-            'arrival_hour',
-            'return_departure_hour',
-            'return_arrival_hour',
-            'total_flight_time',
-            'min_total_flight_time',
-            'total_flight_ratio',
-            'score',  # from support
-            'rank',  # from support
-        ]
-        bool_features = [
-            'isbaggage',
-            'isrefundpermitted',
-            'isexchangepermitted',
-            'isdiscount',
-            'intravelpolicy',
-            'has_intravelpolicy_variant',
-            'has_intravelpolicy_variant_1_segment',
-            'has_not_economy_in_policy',
-            'client_has_travellergrade',
-            'class_is_economy',
-            'class_is_business',
-            'round_trip',
-            'predict',  # from support
-            'in_top5_rank',  # from support
-        ]
-        used = target + num_features + bool_features + exclude_but_keep
-        predictors = num_features + bool_features
-        prepared_data = train_data.drop(columns=[col for col in train_data.columns if col not in used])
-        logging.info('Data prepared')
-
-        return PreparedResult(data=prepared_data, target_column=target, features_columns=predictors)
+    target = ['sentoption']
+    exclude_but_keep = ['id', 'requestid']
+    num_features = [
+        'segmentcount',
+        'amount',
+        'min_price',
+        'price_diff',
+        'price_ratio',
+        'min_return_time',
+        'return_time',
+        'return_time_ratio',
+        'min_to_time',
+        'to_time',
+        'to_time_ratio',
+        'min_departure_diff_seconds',
+        'departure_diff_seconds',
+        'client_travellergrade',
+        'min_segments_count',
+        'segments_diff',
+        'departure_hour',
+        'arrival_hour',
+        'return_departure_hour',
+        'return_arrival_hour',
+        'total_flight_time',
+        'min_total_flight_time',
+        'total_flight_ratio',
+        'score',  # from support
+        'rank',  # from support
+    ]
+    bool_features = [
+        'isbaggage',
+        'isrefundpermitted',
+        'isexchangepermitted',
+        'isdiscount',
+        'intravelpolicy',
+        'has_intravelpolicy_variant',
+        'has_intravelpolicy_variant_1_segment',
+        'has_not_economy_in_policy',
+        'client_has_travellergrade',
+        'class_is_economy',
+        'class_is_business',
+        'round_trip',
+        'predict',  # from support
+        'in_top5_rank',  # from support
+    ]
 
     def learn(self, prepared_data: PreparedResult):
-        X_train, X_test, y_train, y_test = train_test_split(
-            prepared_data.features_frame,
-            prepared_data.target_frame,
-            test_size=0.1,
-            random_state=41,
-        )
+        # requests are not split between train and test
+        train_data, test_data = prepared_data.split_requests(test_size=self.eval_requests_share, random_state=41)
+        X_train, X_test = train_data.features_frame, test_data.features_frame
+        y_train, y_test = train_data.target_frame, test_data.target_frame
         # Prepare model
         model = CatBoostClassifier(iterations=600, eval_metric='Logloss', verbose=True)
         # Fit model
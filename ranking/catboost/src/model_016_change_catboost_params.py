@@ -1,160 +1,107 @@
 import logging
-import re
 
-import pandas as pd
-from catboost import CatBoostClassifier, Pool, CatBoostRanker
+import numpy as np
+from catboost import CatBoostClassifier, CatBoostRanker
 from sklearn.metrics import classification_report
-from sklearn.model_selection import train_test_split
 from sqlalchemy import Boolean, Column, Float, Integer, text
 from sqlalchemy.orm import declarative_base, sessionmaker
 from sqlalchemy.sql import insert
 
 from ranking.catboost.src.lib import AbstractTrainFlow, PreparedResult
 
+# losses learned on pairs only, the label of their pool is row id
+PAIR_LOSSES = ('PairLogit', 'PairLogitPairwise')
+
 
 class CatboostTrainFlow16(AbstractTrainFlow):
     model_name = 'model_016_pair_logit_2000'
-
-    def prepare_features(
-            self,
-            limit: int | None = None,
-            filter_for_test: bool = False,
-            table_prefix: str = 'agent',
-    ) -> PreparedResult:
-        if filter_for_test:
-            assert isinstance(self.sampling_table_name, str)
-            assert re.match("^[a-z0-9_]*$", self.sampling_table_name)
-            if limit is not None:
-                assert isinstance(limit, int)
-                select_query = f""" --sql
-                    SELECT 
-                        {table_prefix}_requests.*, 
-                        {table_prefix}_requests_features.* 
-                    FROM {table_prefix}_requests
-                    join {table_prefix}_requests_features 
-                        on {table_prefix}_requests.id = {table_prefix}_requests_features.id
-                    join {self.sampling_table_name} a on {table_prefix}_requests.id = a.id and for_test=False
-                    order by requestid
-                    LIMIT {limit};
-                """
-            else:
-                select_query = f"""
-                    SELECT 
-                        {table_prefix}_requests.*, 
-                        {table_prefix}_requests_features.* 
-                    FROM {table_prefix}_requests
-                    join {table_prefix}_requests_features 
-                        on {table_prefix}_requests.id = {table_prefix}_requests_features.id
-                    join {self.sampling_table_name} a on {table_prefix}_requests.id = a.id and for_test=False
-                    order by requestid
-                """
-        else:
-            if limit is not None:
-                assert isinstance(limit, int)
-                select_query = f"""
-                    SELECT * 
-                    FROM {table_prefix}_requests
-                    join {table_prefix}_requests_features 
-                        on {table_prefix}_requests.id = {table_prefix}_requests_features.id
-                    order by requestid 
-                    LIMIT {limit};
-                """
-            else:
-                select_query = f"""
-                    SELECT * 
-                    FROM {table_prefix}_requests
-                    join {table_prefix}_requests_features 
-                        on {table_prefix}_requests.id = {table_prefix}_requests_features.id
-                    order by requestid;
-                """
-
-        train_data = pd.read_sql(select_query, self.db_engine)
-        logging.info('Data select done')
-
-        target = ['sentoption_fixed']
-        exclude_but_keep = ['id', 'requestid', 'sentoption_flight', 'fligtoption']
-        num_features = [
-            'segmentcount',
-            'amount',
-            'min_price',
-            'price_diff',
-            'price_ratio',
-            'min_return_time',
-            'return_time',
-            'return_time_abs',
-            'return_time_abs_ratio',
-            'min_to_time',
-            'to_time',
-            'to_time_abs',
-            'to_time_abs_ratio',
-            'min_departure_diff_seconds',
-            'departure_diff_seconds',
-            'client_travellergrade',
-            'min_segments_count',
-            'segments_diff',
-            'departure_hour',
-            'arrival_hour',
-            'return_departure_hour',
-            'return_arrival_hour',
-            'total_flight_time',
-            'min_total_flight_time',
-            'total_flight_ratio',
-            'timezone_diff',
-            'to_city_timezone',
-            'from_city_timezone',
-            'departure_week_day',
-            'return_week_day',
-            'request_before_x_days',
-            'stay_x_days',
-            'price_rank',
-            'price_leg_rank',
-            'duration_rank',
-            'segments_rank',
-            'flights_variability',
-            'departuredate_variability',
-        ]
-        bool_features = [
-            'isbaggage',
-            'isrefundpermitted',
-            'isexchangepermitted',
-            'isdiscount',
-            'intravelpolicy',
-            'has_intravelpolicy_variant',
-            'has_intravelpolicy_variant_1_segment',
-            'has_not_economy_in_policy',
-            'client_has_travellergrade',
-            'class_is_economy',
-            'class_is_business',
-            'round_trip',
-            'one_segment_trip',
-            'is_international',
-            'same_options_best_price',
-        ]
-        text_features = [
-            'operator_code',  # enum
-            'to_city_iatacode',
-            'from_city_iatacode',
-            'client'
-        ]
-        used = target + num_features + bool_features + exclude_but_keep + text_features
-        predictors = num_features + bool_features + text_features
-        prepared_data = train_data.drop(columns=[col for col in train_data.columns if col not in used])
-        logging.info('Data prepared')
-
-        return PreparedResult(
-            data=prepared_data,
-            target_column=target,
-            features_columns=predictors,
-            text_features=text_features,
-        )
+    target = ['sentoption_fixed']
+    exclude_but_keep = ['id', 'requestid', 'sentoption_flight', 'fligtoption']
+    num_features = [
+        'segmentcount',
+        'amount',
+        'min_price',
+        'price_diff',
+        'price_ratio',
+        'min_return_time',
+        'return_time',
+        'return_time_abs',
+        'return_time_abs_ratio',
+        'min_to_time',
+        'to_time',
+        'to_time_abs',
+        'to_time_abs_ratio',
+        'min_departure_diff_seconds',
+        'departure_diff_seconds',
+        'client_travellergrade',
+        'min_segments_count',
+        'segments_diff',
+        'departure_hour',
+        'arrival_hour',
+        'return_departure_hour',
+        'return_arrival_hour',
+        'total_flight_time',
+        'min_total_flight_time',
+        'total_flight_ratio',
+        'timezone_diff',
+        'to_city_timezone',
+        'from_city_timezone',
+        'departure_week_day',
+        'return_week_day',
+        'request_before_x_days',
+        'stay_x_days',
+        'price_rank',
+        'price_leg_rank',
+        'duration_rank',
+        'segments_rank',
+        'flights_variability',
+        'departuredate_variability',
+    ]
+    bool_features = [
+        'isbaggage',
+        'isrefundpermitted',
+        'isexchangepermitted',
+        'isdiscount',
+        'intravelpolicy',
+        'has_intravelpolicy_variant',
+        'has_intravelpolicy_variant_1_segment',
+        'has_not_economy_in_policy',
+        'client_has_travellergrade',
+        'class_is_economy',
+        'class_is_business',
+        'round_trip',
+        'one_segment_trip',
+        'is_international',
+        'same_options_best_price',
+    ]
+    text_features = [
+        'operator_code',  # enum
+        'to_city_iatacode',
+        'from_city_iatacode',
+        'client'
+    ]
+    compact = True
+    computed_labels = ['sentoption_fixed', 'sentoption_flight']
+    # None keeps all pairs with not sent flights options, set to bound pairs count for large requests
+    max_trash_pairs_per_winner: int | None = None
+    pairs_random_state: int | None = 41
+    # set (200) to stop when test_rank_score of sentoption_fixed on held out requests stops improving;
+    # it learns on 90% of requests then, save such a model under a new model_name
+    early_stopping_rounds: int | None = None
+
+    def learn_pool_params(self, loss_function: str | None = None) -> dict:
+        if loss_function is not None and loss_function.split(':')[0] not in PAIR_LOSSES:
+            # YetiRank and other group losses ignore pairs: sent options are relevant ones
+            return super().learn_pool_params(loss_function)
+        return {
+            'label_column': 'id',
+            'pairs': {
+                'max_trash_per_winner': self.max_trash_pairs_per_winner,
+                'random_state': self.pairs_random_state,
+            },
+        }
 
     def learn(self, prepared_data: PreparedResult):
-        # X_train, X_test, y_train, y_test = train_test_split(
-        #     prepared_data.features_frame,
-        #     prepared_data.target_frame,
-        #     test_size=0.1,
-        #     random_state=41,
-        # )
         # Prepare model
         model = CatBoostRanker(
             iterations=2000,
@@ -163,21 +110,7 @@ class CatboostTrainFlow16(AbstractTrainFlow):
             verbose=True,
             cat_features=prepared_data.text_features,
         )
-        pairs = prepared_data.make_pairs()
-        logging.info(len(pairs))
-        pool = Pool(
-            prepared_data.features_frame,
-            label=prepared_data.data['id'],
-            pairs=pairs,
-            cat_features=prepared_data.text_features,
-            group_id=prepared_data.request_id_frame,
-        )
-        model.fit(
-            pool,
-            verbose=True,
-            # eval_set=pool,
-        )
-        self.model = model
+        self.model = self.fit_model(model, prepared_data)
         # pred = model.predict(X_test)
         # bool_result = list(map(lambda rec: rec == 'True', pred))
         # print(classification_report(y_test, bool_result))
@@ -192,6 +125,10 @@ class CatboostTrainFlow16(AbstractTrainFlow):
         from_file_model.load_model(self.model_name)
         self.model = from_file_model
 
+    def predict_scores(self, prepared_data: PreparedResult) -> tuple[np.ndarray, np.ndarray]:
+        scores = self.model.predict(prepared_data.features_frame)
+        return scores > 0.5, scores
+
     def apply_model_in_db(self, to_client=False, to_final_test=False):
         assert self.model is not None
         Session = sessionmaker(bind=self.db_engine)
@@ -212,12 +149,6 @@ class CatboostTrainFlow16(AbstractTrainFlow):
 
             table_prefix = 'client' if to_client else ('final_test' if to_final_test else 'agent')
             logging.info(table_prefix)
-            data = self.prepare_features(table_prefix=table_prefix)
-            ids = data.data[['id']]
-            predicts = self.model.predict(data.features_frame)
-            # predict_scores = self.model.predict(data.features_frame)
-            logging.info('predicts calculated')
-
             Base = declarative_base()
 
             class PredictTable(Base):
@@ -226,19 +157,25 @@ class CatboostTrainFlow16(AbstractTrainFlow):
                 predict = Column(Boolean)
                 score = Column(Float)
 
-            id_with_predict_and_score = list(zip(ids['id'], predicts))
-            chunk_size = 10000
-            for chunk in range(0, len(id_with_predict_and_score) // chunk_size + 1):
-                if chunk * chunk_size < len(id_with_predict_and_score):
-                    session.execute(
-                        insert(PredictTable),
-                        [
-                            {'id': id_value, 'predict': score > 0.5, 'score': score}
-                            for id_value, score
-                            in id_with_predict_and_score[chunk * chunk_size:(chunk + 1) * chunk_size]
-                        ],
-                    )
-                logging.info('saved chunk %r', chunk)
+            for data_chunk, data in enumerate(self.iter_prepare_features(table_prefix=table_prefix)):
+                ids = data.data[['id']]
+                predicts = self.model.predict(data.features_frame)
+                # predict_scores = self.model.predict(data.features_frame)
+                logging.info('predicts calculated for data chunk %r', data_chunk)
+
+                id_with_predict_and_score = list(zip(ids['id'], predicts))
+                chunk_size = 10000
+                for chunk in range(0, len(id_with_predict_and_score) // chunk_size + 1):
+                    if chunk * chunk_size < len(id_with_predict_and_score):
+                        session.execute(
+                            insert(PredictTable),
+                            [
+                                {'id': id_value, 'predict': score > 0.5, 'score': score}
+                                for id_value, score
+                                in id_with_predict_and_score[chunk * chunk_size:(chunk + 1) * chunk_size]
+                            ],
+                        )
+                    logging.info('saved chunk %r', chunk)
             session.commit()
             logging.info('saved to db finished')
 
@@ -0,0 +1,207 @@
+import logging
+from collections.abc import Iterator
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from ranking.catboost.src.groups import RequestGroups
+from ranking.catboost.src.labels import LABELS, add_labels, flag_mask
+
+
+def _group_offsets(codes: np.ndarray, groups_count: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    stable sort rows by group code
+
+    :return: row order, group start offsets in that order, group sizes
+    """
+    order = np.argsort(codes, kind='stable')
+    sizes = np.bincount(codes, minlength=groups_count)
+    starts = np.zeros(groups_count, dtype=np.int64)
+    np.cumsum(sizes[:-1], out=starts[1:])
+    return order, starts, sizes
+
+
+class PairLayout:
+    """
+    Columnar description of the PairLogit pairs of a frame.
+
+    Each winner (sentoption_fixed option of a sent flight) owns a contiguous segment of pairs:
+    first the misses of the same flight in the request, then the trash options of the request.
+    Requests go in requestid order, flights in order of their first appearance in the request,
+    so for a frame ordered by requestid and without a cap the pairs are exactly those
+    of the former row by row make_pairs.
+
+    Pairs are materialized lazily by global pair position (see `take`), so any range of them
+    costs memory proportional to the range only.
+    """
+
+    def __init__(
+            self,
+            data: pd.DataFrame,
+            max_trash_per_winner: int | None = None,
+            random_state: int | None = None,
+            groups: RequestGroups | None = None,
+    ):
+        """
+        :param data: frame with requestid, fligtoption, sentoption_flight, sentoption_fixed columns
+            (absent labels are computed from their inputs, see labels.add_labels)
+        :param max_trash_per_winner: cap of trash pairs per winner, None means all trash options of request
+        :param random_state: seed to pick capped trash options at random,
+            None means the first options of request (deterministic)
+        :param groups: request index of data, built when not given
+        """
+        assert max_trash_per_winner is None or max_trash_per_winner >= 0
+        if groups is None:
+            groups = RequestGroups(data['requestid'].to_numpy())
+        assert groups.rows_count == len(data)
+        request_codes = groups.codes
+        flight_codes, flights = pd.factorize(data['fligtoption'], use_na_sentinel=False)
+        positions = np.arange(len(data), dtype=np.int64)
+
+        labeled = add_labels(data, [label for label in LABELS if label not in data.columns])
+        trash = flag_mask(labeled['sentoption_flight'], False)
+        sent = flag_mask(labeled['sentoption_fixed'], True)
+
+        # (request, flight) groups of not trash rows, numbered by first appearance
+        flight_keys = request_codes[~trash].astype(np.int64) * max(len(flights), 1) + flight_codes[~trash]
+        group_codes_of_kept, group_keys = pd.factorize(flight_keys)
+        group_codes = np.full(len(data), -1, dtype=np.int64)
+        group_codes[~trash] = group_codes_of_kept
+        groups_count = len(group_keys)
+
+        winners = positions[~trash & sent]
+        winner_groups = group_codes[winners]
+        winner_requests = request_codes[winners]
+        winners_order = np.lexsort((winners, winner_groups, winner_requests))
+        self.winners: np.ndarray = winners[winners_order]
+        self.winner_groups: np.ndarray = winner_groups[winners_order]
+        self.winner_requests: np.ndarray = winner_requests[winners_order]
+
+        misses = positions[~trash & ~sent]
+        miss_order, self.miss_starts, self.miss_sizes = _group_offsets(group_codes[misses], groups_count)
+        self.misses: np.ndarray = misses[miss_order]
+
+        # trash rows grouped by request come straight from the request index, no sort needed
+        trash_rows = positions[trash]
+        self.trash_sizes: np.ndarray = groups.count(trash)
+        self.trash_starts: np.ndarray = np.zeros(groups.groups_count, dtype=np.int64)
+        np.cumsum(self.trash_sizes[:-1], out=self.trash_starts[1:])
+        sorted_trash = groups.order[trash[groups.order]]
+        winner_trash_sizes = self.trash_sizes[self.winner_requests]
+        if max_trash_per_winner is not None and random_state is not None:
+            # shuffle trash inside each request and give every winner a random window of it
+            rng = np.random.default_rng(random_state)
+            trash_order = np.lexsort((rng.random(len(trash_rows)), request_codes[trash_rows]))
+            sorted_trash = trash_rows[trash_order]
+            self.winner_trash_offsets: np.ndarray = np.floor(
+                rng.random(len(self.winners)) * winner_trash_sizes
+            ).astype(np.int64)
+        else:
+            self.winner_trash_offsets = np.zeros(len(self.winners), dtype=np.int64)
+        self.trash: np.ndarray = sorted_trash
+
+        if max_trash_per_winner is not None:
+            winner_trash_sizes = np.minimum(winner_trash_sizes, max_trash_per_winner)
+        self.winner_miss_counts: np.ndarray = self.miss_sizes[self.winner_groups]
+        self.winner_pair_counts: np.ndarray = self.winner_miss_counts + winner_trash_sizes
+        self.winner_pair_ends: np.ndarray = np.cumsum(self.winner_pair_counts)
+
+    @property
+    def pairs_count(self) -> int:
+        return int(self.winner_pair_ends[-1]) if len(self.winner_pair_ends) else 0
+
+    def take(self, start: int, stop: int) -> np.ndarray:
+        """
+        pairs with global positions in [start, stop)
+
+        :return: int32 array of shape (stop - start, 2) with row positions [winner, loser]
+        """
+        stop = min(stop, self.pairs_count)
+        pair_positions = np.arange(start, max(start, stop), dtype=np.int64)
+        winner_index = np.searchsorted(self.winner_pair_ends, pair_positions, side='right')
+        local = pair_positions - (self.winner_pair_ends - self.winner_pair_counts)[winner_index]
+        miss_counts = self.winner_miss_counts[winner_index]
+        is_miss = local < miss_counts
+        is_trash = ~is_miss
+
+        result = np.empty((len(pair_positions), 2), dtype=np.int32)
+        result[:, 0] = self.winners[winner_index]
+
+        miss_winners = winner_index[is_miss]
+        result[is_miss, 1] = self.misses[self.miss_starts[self.winner_groups[miss_winners]] + local[is_miss]]
+
+        trash_winners = winner_index[is_trash]
+        trash_requests = self.winner_requests[trash_winners]
+        trash_local = (
+            self.winner_trash_offsets[trash_winners] + local[is_trash] - miss_counts[is_trash]
+        ) % self.trash_sizes[trash_requests]
+        result[is_trash, 1] = self.trash[self.trash_starts[trash_requests] + trash_local]
+        return result
+
+    def to_array(self) -> np.ndarray:
+        return self.take(0, self.pairs_count)
+
+    def iter_chunks(self, chunk_size: int) -> Iterator[np.ndarray]:
+        assert chunk_size > 0
+        for start in range(0, self.pairs_count, chunk_size):
+            yield self.take(start, start + chunk_size)
+
+    def write_file(self, path: str | Path, chunk_size: int = 1_000_000) -> int:
+        """
+        write pairs in CatBoost pairs file format (tab separated `winner<TAB>loser` per line)
+
+        :return: written pairs count
+        """
+        with open(path, 'w') as pairs_file:
+            for chunk in self.iter_chunks(chunk_size):
+                np.savetxt(pairs_file, chunk, fmt='%d', delimiter='\t')
+        logging.info('%r pairs written to %s', self.pairs_count, path)
+        return self.pairs_count
+
+
+def build_pairs(
+        data: pd.DataFrame,
+        max_trash_per_winner: int | None = None,
+        random_state: int | None = None,
+        groups: RequestGroups | None = None,
+) -> np.ndarray:
+    """
+    build PairLogit pairs [winner_pos, loser_pos] for frame rows
+
+    :param data: frame with requestid, fligtoption, sentoption_flight, sentoption_fixed columns
+    :param max_trash_per_winner: cap of trash pairs per winner
+    :param random_state: seed for random choice of capped trash pairs
+    :param groups: request index of data
+    :return: int32 array of shape (n_pairs, 2) with row positions
+    """
+    return PairLayout(data, max_trash_per_winner, random_state, groups).to_array()
+
+
+def iter_pairs(
+        data: pd.DataFrame,
+        chunk_size: int = 1_000_000,
+        max_trash_per_winner: int | None = None,
+        random_state: int | None = None,
+        groups: RequestGroups | None = None,
+) -> Iterator[np.ndarray]:
+    """
+    same pairs as `build_pairs` yielded by chunks of at most chunk_size pairs
+    """
+    return PairLayout(data, max_trash_per_winner, random_state, groups).iter_chunks(chunk_size)
+
+
+def write_pairs_file(
+        data: pd.DataFrame,
+        path: str | Path,
+        chunk_size: int = 1_000_000,
+        max_trash_per_winner: int | None = None,
+        random_state: int | None = None,
+        groups: RequestGroups | None = None,
+) -> int:
+    """
+    stream pairs to CatBoost pairs file, usable with file or quantized pools: Pool('quantized://...', pairs=path)
+
+    :return: written pairs count
+    """
+    return PairLayout(data, max_trash_per_winner, random_state, groups).write_file(path, chunk_size)
@@ -0,0 +1,144 @@
+import re
+from collections import Counter
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+# `SU6449 LEDTJM 2022.06.15`: operator, flight number, from and to codes, departure date
+LEG_RE = re.compile(
+    r'^\s*(?P<operator>\S{2})(?P<number>\S*)\s+(?P<route>\S{6})\s+(?P<date>\d{4}\.\d{2}\.\d{2})\s*$'
+)
+CYRILLIC_RE = re.compile('[Ѐ-ӿ]')
+# latin letters typed instead of the same looking cyrillic ones in internal codes (ЧАР, КЯС, СЕН, БОЧ, НЖГ)
+LATIN_TO_CYRILLIC = str.maketrans('ABCEHKMOPTXY', 'АВСЕНКМОРТХУ')
+
+LEG_COLUMNS = ['operator', 'flight_number', 'from_iata', 'to_iata', 'date']
+OPTION_COLUMNS = [
+    'flightoption_start_iata',
+    'flightoption_end_iata',
+    'flight_option_operator_codes',
+    'first_flight_option_operator_code',
+    'first_flight_option_operator_count',
+    'legs_count',
+]
+ROUTE_COLUMNS = ['to_departure_iata', 'to_arrival_iata', 'return_departure_iata', 'return_arrival_iata']
+
+
+def normalize_code(code: str | None) -> str | None:
+    """
+    one spelling per code: upper case, internal cyrillic codes fully cyrillic (as in iata_codes of 0015)
+    """
+    if code is None:
+        return None
+    code = code.strip().upper()
+    if not code:
+        return None
+    if CYRILLIC_RE.search(code):
+        return code.translate(LATIN_TO_CYRILLIC)
+    return code
+
+
+@lru_cache(maxsize=2 ** 18)
+def parse_leg(leg: str) -> tuple[str | None, str | None, str | None, str | None, str | None]:
+    """
+    :return: operator, flight number, from code, to code, date as yyyy.mm.dd; Nones for not parsed leg
+    """
+    match = LEG_RE.match(leg)
+    if match is None:
+        return None, None, None, None, None
+    route = match['route']
+    return (
+        normalize_code(match['operator']),
+        match['number'],
+        normalize_code(route[:3]),
+        normalize_code(route[3:]),
+        match['date'],
+    )
+
+
+@lru_cache(maxsize=2 ** 18)
+def parse_flight_option(option: str) -> tuple[tuple, ...]:
+    """
+    legs of FligtOption, the same strings recur over requests so results are memoized
+    """
+    return tuple(parse_leg(leg) for leg in option.split('/'))
+
+
+def _option_summary(legs: tuple[tuple, ...]) -> tuple:
+    operators = [leg[0] for leg in legs if leg[0] is not None]
+    counts = Counter(operators)
+    # mode() within group (order by operator_code): the most frequent, the smallest one of ties
+    mode = min(counts, key=lambda code: (-counts[code], code)) if counts else None
+    return (
+        legs[0][2],
+        legs[-1][3],
+        tuple(sorted(counts)),
+        mode,
+        len(counts) if counts else None,
+        len(legs),
+    )
+
+
+def parse_flight_options(values: pd.Series) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    columnar parse of FligtOption column, every distinct string is parsed once
+
+    :return: legs (row position, leg number and LEG_COLUMNS, one row per leg),
+        options (OPTION_COLUMNS aligned with values, as agent_request_parsed_info of 0016)
+    """
+    codes, uniques = pd.factorize(values)
+    parsed = [parse_flight_option(option) for option in uniques]
+
+    summaries = pd.DataFrame([_option_summary(legs) for legs in parsed], columns=OPTION_COLUMNS)
+    summaries = summaries.astype({'first_flight_option_operator_count': 'Int64', 'legs_count': 'Int64'})
+    known = codes >= 0
+    options = summaries.reindex(np.where(known, codes, -1)).reset_index(drop=True)
+    options.index = values.index
+
+    legs_counts = np.array([len(legs) for legs in parsed], dtype=np.int64)
+    unique_legs = pd.DataFrame([leg for legs in parsed for leg in legs], columns=LEG_COLUMNS)
+    unique_legs['date'] = pd.to_datetime(unique_legs['date'], format='%Y.%m.%d', errors='coerce')
+    leg_starts = np.zeros(len(parsed), dtype=np.int64)
+    np.cumsum(legs_counts[:-1], out=leg_starts[1:])
+
+    # legs of every row: unique option legs repeated for each row of the option
+    rows = np.flatnonzero(known)
+    row_legs_counts = legs_counts[codes[rows]]
+    row_positions = np.repeat(rows, row_legs_counts)
+    row_leg_starts = np.cumsum(row_legs_counts) - row_legs_counts
+    leg_numbers = np.arange(len(row_positions)) - np.repeat(row_leg_starts, row_legs_counts)
+    legs = unique_legs.iloc[leg_starts[codes[row_positions]] + leg_numbers].reset_index(drop=True)
+    legs.insert(0, 'leg', leg_numbers)
+    legs.insert(0, 'row', row_positions)
+    return legs, options
+
+
+def parse_search_routes(values: pd.Series) -> pd.DataFrame:
+    """
+    SearchRoute `TJMLED/LEDTJM` split as in 0016: to departure and arrival, return departure and arrival
+    """
+    codes, uniques = pd.factorize(values)
+    parsed = pd.DataFrame(
+        [
+            [
+                normalize_code(route[0:3]),
+                normalize_code(route[3:6]),
+                normalize_code(route[7:10]),
+                normalize_code(route[10:13]),
+            ]
+            for route in uniques
+        ],
+        columns=ROUTE_COLUMNS,
+    )
+    routes = parsed.reindex(np.where(codes >= 0, codes, -1)).reset_index(drop=True)
+    routes.index = values.index
+    return routes
+
+
+def parse_locations(raw: pd.DataFrame) -> pd.DataFrame:
+    """
+    agent_request_parsed_info columns of raw option rows computed in process
+    """
+    _, options = parse_flight_options(raw['fligtoption'])
+    return pd.concat([parse_search_routes(raw['searchroute']), options], axis=1)
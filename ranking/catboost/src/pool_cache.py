@@ -0,0 +1,67 @@
+import logging
+import os
+from pathlib import Path
+
+import catboost
+import pandas as pd
+from catboost import Pool
+
+from ranking.catboost.src.cache import FeatureCache
+from ranking.catboost.src.feature_store import frame_hash
+
+
+class PoolCache:
+    """
+    Quantized CatBoost pools saved on disk, keyed by the prepared feature set and quantization params.
+
+    Pool files keep quantized features, hashed cat features and group ids.
+    Quantized pools do not store pairs, they are kept in a pairs file next to the pool
+    and given back on load: Pool('quantized://...', pairs=path).
+    """
+
+    def __init__(self, cache_dir: str | Path = 'pool_cache'):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def make_key(data: pd.DataFrame, **parts) -> str:
+        """
+        :param data: prepared data the pool is built from (features, labels, group column)
+        :param parts: pool params: feature columns, pairs sampling, quantization
+        """
+        return FeatureCache.make_key(data=frame_hash(data), catboost=catboost.__version__, **parts)
+
+    def pool_path(self, key: str) -> Path:
+        return self.cache_dir / f'{key}.quantized'
+
+    def pairs_path(self, key: str) -> Path:
+        return self.cache_dir / f'{key}.pairs'
+
+    def load(self, key: str) -> Pool | None:
+        """
+        :return: quantized pool with pairs or None on cache miss
+        """
+        pool_path, pairs_path = self.pool_path(key), self.pairs_path(key)
+        if not pool_path.exists():
+            return None
+        pool = Pool(f'quantized://{pool_path}', pairs=str(pairs_path) if pairs_path.exists() else None)
+        logging.info('Pool cache hit %s: %r rows, %r pairs', key[:12], pool.num_row(), pool.num_pairs())
+        return pool
+
+    def save(self, key: str, pool: Pool, write_pairs=None):
+        """
+        :param pool: quantized pool
+        :param write_pairs: callable writing pairs file to the given path, None for pools without pairs
+        """
+        assert pool.is_quantized()
+        if write_pairs is not None:
+            tmp_pairs_path = self.pairs_path(key).with_suffix('.pairs_tmp')
+            write_pairs(tmp_pairs_path)
+            os.replace(tmp_pairs_path, self.pairs_path(key))
+        # pool file goes last: it marks a complete entry
+        pool_path = self.pool_path(key)
+        tmp_pool_path = pool_path.with_suffix('.quantized_tmp')
+        tmp_pool_path.unlink(missing_ok=True)
+        pool.save(str(tmp_pool_path))
+        os.replace(tmp_pool_path, pool_path)
+        logging.info('Pool cache saved %s: %.1f MB', key[:12], pool_path.stat().st_size / 2 ** 20)
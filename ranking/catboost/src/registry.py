@@ -0,0 +1,89 @@
+from collections.abc import Callable
+from typing import Any
+
+# grain of a feature value: one per request or one per option row; intermediates have no grain
+REQUEST = 'request'
+OPTION = 'option'
+
+
+class Feature:
+    def __init__(self, name: str, inputs: list[str], kernel: Callable, grain: str | None):
+        """
+        :param inputs: names of sources and other features, passed to kernel as positional arguments
+        :param grain: REQUEST, OPTION or None for intermediate values (frames, dicts of arrays)
+        """
+        assert grain in (REQUEST, OPTION, None)
+        self.name: str = name
+        self.inputs: list[str] = inputs
+        self.kernel: Callable = kernel
+        self.grain: str | None = grain
+
+
+class FeatureRegistry:
+    """
+    features declared with their inputs, grain and kernel;
+    a list of wanted features is computed as the subgraph they depend on in topological order,
+    every node once, so intermediates (parsed columns, durations, request groups) are shared by their consumers
+    """
+
+    def __init__(self, sources: list[str]):
+        """
+        :param sources: names of values given to compute: raw rows, reference data, settings
+        """
+        self.sources: list[str] = sources
+        self.features: dict[str, Feature] = {}
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.features
+
+    def __getitem__(self, name: str) -> Feature:
+        return self.features[name]
+
+    def add(self, name: str, inputs: list[str], kernel: Callable, grain: str | None = OPTION):
+        assert name not in self.features and name not in self.sources, f'{name} is already declared'
+        self.features[name] = Feature(name, inputs, kernel, grain)
+
+    def register(self, name: str, inputs: list[str], grain: str | None = OPTION) -> Callable:
+        """
+        decorator form of add
+        """
+        def decorator(kernel: Callable) -> Callable:
+            self.add(name, inputs, kernel, grain)
+            return kernel
+
+        return decorator
+
+    def plan(self, names: list[str]) -> list[str]:
+        """
+        features needed for names in topological order (inputs before their consumers)
+        """
+        order = []
+        state = {}
+
+        def visit(name: str, path: tuple[str, ...]):
+            if name in self.sources or state.get(name) == 'done':
+                return
+            assert name in self.features, f'unknown feature {name} (needed by {" <- ".join(path) or "caller"})'
+            assert state.get(name) != 'visiting', f'dependency cycle: {" <- ".join(path + (name,))}'
+            state[name] = 'visiting'
+            for input_name in self.features[name].inputs:
+                visit(input_name, path + (name,))
+            state[name] = 'done'
+            order.append(name)
+
+        for name in names:
+            visit(name, ())
+        return order
+
+    def compute(self, names: list[str], sources: dict[str, Any]) -> dict[str, Any]:
+        """
+        :param sources: values of all registry sources
+        :return: values of names and of every intermediate computed for them
+        """
+        missing = [source for source in self.sources if source not in sources]
+        assert not missing, f'sources not given: {missing}'
+        values = dict(sources)
+        for name in self.plan(names):
+            feature = self.features[name]
+            values[name] = feature.kernel(*(values[input_name] for input_name in feature.inputs))
+        return values
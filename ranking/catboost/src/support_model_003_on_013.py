@@ -1,10 +1,8 @@
 import logging
-import re
 
-import pandas as pd
+import numpy as np
 from catboost import CatBoostClassifier
 from sklearn.metrics import classification_report
-from sklearn.model_selection import train_test_split
 from sqlalchemy import Boolean, Column, Float, Integer, text
 from sqlalchemy.orm import declarative_base, sessionmaker
 from sqlalchemy.sql import insert
@@ -14,134 +12,73 @@ from ranking.catboost.src.lib import AbstractTrainFlow, PreparedResult
 
 class SupportModelCatboost3(AbstractTrainFlow):
     model_name = 'support_model_003_on_013'
-
-    def prepare_features(
-            self,
-            limit: int | None = None,
-            filter_for_test: bool = False,
-            table_prefix: str = 'agent',
-    ) -> PreparedResult:
-        if filter_for_test:
-            assert isinstance(self.sampling_table_name, str)
-            assert re.match("^[a-z0-9_]*$", self.sampling_table_name)
-            if limit is not None:
-                assert isinstance(limit, int)
-                select_query = f""" --sql
-                    SELECT {table_prefix}_requests.*, {table_prefix}_requests_features.* 
-                    FROM {table_prefix}_requests
-                    join {table_prefix}_requests_features 
-                        on {table_prefix}_requests.id = {table_prefix}_requests_features.id
-                    join {self.sampling_table_name} a on {table_prefix}_requests.id = a.id and for_test=False
-                    LIMIT {limit};
-                """
-            else:
-                select_query = f"""
-                    SELECT {table_prefix}_requests.*, {table_prefix}_requests_features.*  
-                    FROM {table_prefix}_requests 
-                    join {table_prefix}_requests_features 
-                        on {table_prefix}_requests.id = {table_prefix}_requests_features.id
-                    join {self.sampling_table_name} a on {table_prefix}_requests.id = a.id and for_test=False;
-                """
-        else:
-            if limit is not None:
-                assert isinstance(limit, int)
-                select_query = f"""
-                    SELECT * 
-                    FROM {table_prefix}_requests
-                    join {table_prefix}_requests_features 
-                        on {table_prefix}_requests.id = {table_prefix}_requests_features.id 
-                    LIMIT {limit};
-                """
-            else:
-                select_query = f"""
-                    SELECT * 
-                    FROM {table_prefix}_requests
-                    join {table_prefix}_requests_features 
-                        on {table_prefix}_requests.id = {table_prefix}_requests_features.id 
-                """
-
-        train_data = pd.read_sql(select_query, self.db_engine)
-        logging.info('Data select done')
-
-        target = ['sentoption']
-        exclude_but_keep = ['id']
-        num_features = [
-            'segmentcount',
-            'amount',
-            'min_price',
-            'price_diff',
-            'price_ratio',
-            'min_return_time',
-            'return_time',
-            'return_time_abs',
-            'return_time_abs_ratio',
-            'min_to_time',
-            'to_time',
-            'to_time_abs',
-            'to_time_abs_ratio',
-            'min_departure_diff_seconds',
-            'departure_diff_seconds',
-            'client_travellergrade',
-            'min_segments_count',
-            'segments_diff',
-            'departure_hour',
-            'arrival_hour',
-            'return_departure_hour',
-            'return_arrival_hour',
-            'total_flight_time',
-            'min_total_flight_time',
-            'total_flight_ratio',
-            'timezone_diff',
-            'to_city_timezone',
-            'from_city_timezone',
-            'departure_week_day',
-            'return_week_day',
-            'request_before_x_days',
-            'stay_x_days',
-            'price_rank',
-            'duration_rank',
-            'segments_rank',
-        ]
-        bool_features = [
-            'isbaggage',
-            'isrefundpermitted',
-            'isexchangepermitted',
-            'isdiscount',
-            'intravelpolicy',
-            'has_intravelpolicy_variant',
-            'has_intravelpolicy_variant_1_segment',
-            'has_not_economy_in_policy',
-            'client_has_travellergrade',
-            'class_is_economy',
-            'class_is_business',
-            'round_trip',
-            'one_segment_trip',
-            'is_international',
-        ]
-        text_features = [
-            'operator_code',  # enum
-            'to_city_iatacode',
-            'from_city_iatacode',
-        ]
-        used = target + num_features + bool_features + exclude_but_keep + text_features
-        predictors = num_features + bool_features + text_features
-        prepared_data = train_data.drop(columns=[col for col in train_data.columns if col not in used])
-        logging.info('Data prepared')
-
-        return PreparedResult(
-            data=prepared_data,
-            target_column=target,
-            features_columns=predictors,
-            text_features=text_features,
-        )
+    target = ['sentoption']
+    exclude_but_keep = ['id', 'requestid']
+    num_features = [
+        'segmentcount',
+        'amount',
+        'min_price',
+        'price_diff',
+        'price_ratio',
+        'min_return_time',
+        'return_time',
+        'return_time_abs',
+        'return_time_abs_ratio',
+        'min_to_time',
+        'to_time',
+        'to_time_abs',
+        'to_time_abs_ratio',
+        'min_departure_diff_seconds',
+        'departure_diff_seconds',
+        'client_travellergrade',
+        'min_segments_count',
+        'segments_diff',
+        'departure_hour',
+        'arrival_hour',
+        'return_departure_hour',
+        'return_arrival_hour',
+        'total_flight_time',
+        'min_total_flight_time',
+        'total_flight_ratio',
+        'timezone_diff',
+        'to_city_timezone',
+        'from_city_timezone',
+        'departure_week_day',
+        'return_week_day',
+        'request_before_x_days',
+        'stay_x_days',
+        'price_rank',
+        'duration_rank',
+        'segments_rank',
+    ]
+    bool_features = [
+        'isbaggage',
+        'isrefundpermitted',
+        'isexchangepermitted',
+        'isdiscount',
+        'intravelpolicy',
+        'has_intravelpolicy_variant',
+        'has_intravelpolicy_variant_1_segment',
+        'has_not_economy_in_policy',
+        'client_has_travellergrade',
+        'class_is_economy',
+        'class_is_business',
+        'round_trip',
+        'one_segment_trip',
+        'is_international',
+    ]
+    text_features = [
+        'operator_code',  # enum
+        'to_city_iatacode',
+        'from_city_iatacode',
+    ]
+    compact = True
 
     def learn(self, prepared_data: PreparedResult):
-        X_train, X_test, y_train, y_test = train_test_split(
-            prepared_data.features_frame,
-            prepared_data.target_frame,
-            test_size=0.1,
-            random_state=41,
-        )
+        # requests are not split between train and test
+        train_data, test_data = prepared_data.split_requests(test_size=self.eval_requests_share, random_state=41)
+        X_train, X_test = train_data.features_frame, test_data.features_frame
+        y_train, y_test = train_data.target_frame, test_data.target_frame
         # Prepare model
         model = CatBoostClassifier(
             iterations=1000,
@@ -167,6 +104,11 @@ class SupportModelCatboost3(AbstractTrainFlow):
         from_file_model.load_model(self.model_name)
         self.model = from_file_model
 
+    def predict_scores(self, prepared_data: PreparedResult) -> tuple[np.ndarray, np.ndarray]:
+        predicts = self.model.predict(prepared_data.features_frame)
+        predict_scores = self.model.predict_proba(prepared_data.features_frame)
+        return predicts == 'True', predict_scores[:, 1]
+
     def apply_model_in_db(self, to_client=False, to_final_test=False):
         assert self.model is not None
         Session = sessionmaker(bind=self.db_engine)
@@ -186,12 +128,6 @@ class SupportModelCatboost3(AbstractTrainFlow):
             logging.info('result table created')
 
             table_prefix = 'client' if to_client else ('final_test' if to_final_test else 'agent')
-            data = self.prepare_features(table_prefix=table_prefix)
-            ids = data.data[['id']]
-            predicts = self.model.predict(data.features_frame)
-            predict_scores = self.model.predict_proba(data.features_frame)
-            logging.info('predicts calculated')
-
             Base = declarative_base()
 
             class PredictTable(Base):
@@ -200,19 +136,25 @@ class SupportModelCatboost3(AbstractTrainFlow):
                 predict = Column(Boolean)
                 score = Column(Float)
 
-            id_with_predict_and_score = list(zip(ids['id'], predicts, predict_scores))
-            chunk_size = 10000
-            for chunk in range(0, len(id_with_predict_and_score) // chunk_size + 1):
-                if chunk * chunk_size < len(id_with_predict_and_score):
-                    session.execute(
-                        insert(PredictTable),
-                        [
-                            {'id': id_value, 'predict': predict_value == 'True', 'score': score_value[1]}
-                            for id_value, predict_value, score_value
-                            in id_with_predict_and_score[chunk * chunk_size:(chunk + 1) * chunk_size]
-                        ],
-                    )
-                logging.info('saved chunk %r', chunk)
+            for data_chunk, data in enumerate(self.iter_prepare_features(table_prefix=table_prefix)):
+                ids = data.data[['id']]
+                predicts = self.model.predict(data.features_frame)
+                predict_scores = self.model.predict_proba(data.features_frame)
+                logging.info('predicts calculated for data chunk %r', data_chunk)
+
+                id_with_predict_and_score = list(zip(ids['id'], predicts, predict_scores))
+                chunk_size = 10000
+                for chunk in range(0, len(id_with_predict_and_score) // chunk_size + 1):
+                    if chunk * chunk_size < len(id_with_predict_and_score):
+                        session.execute(
+                            insert(PredictTable),
+                            [
+                                {'id': id_value, 'predict': predict_value == 'True', 'score': score_value[1]}
+                                for id_value, predict_value, score_value
+                                in id_with_predict_and_score[chunk * chunk_size:(chunk + 1) * chunk_size]
+                            ],
+                        )
+                    logging.info('saved chunk %r', chunk)
             session.commit()
             logging.info('saved to db finished')
 
@@ -0,0 +1,136 @@
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+from catboost import CatBoostRanker
+
+from ranking.catboost.src.lib import AbstractTrainFlow, PreparedResult
+from ranking.catboost.src.pool_cache import PoolCache
+
+
+def param_grid(**axes: list) -> list[dict]:
+    """
+    all combinations of axes values: param_grid(iterations=[700, 1100], loss_function=['PairLogit', 'YetiRank'])
+    """
+    names = list(axes)
+    return [dict(zip(names, values)) for values in itertools.product(*(axes[name] for name in names))]
+
+
+def split_threads(runs_count: int, workers: int | None = None, cpu_count: int | None = None) -> tuple[int, int]:
+    """
+    :return: concurrent runs, thread_count of every run; cores are split evenly between runs
+    """
+    cpu_count = cpu_count or os.cpu_count() or 1
+    workers = max(1, min(workers or cpu_count, runs_count, cpu_count))
+    return workers, max(1, cpu_count // workers)
+
+
+def _fit_config(
+        number: int,
+        model_class: type,
+        params: dict,
+        cache_dir: str,
+        pool_key: str,
+        test: PreparedResult | None,
+        save_path: str | None,
+) -> dict:
+    """
+    one sweep run in a worker process: load the quantized pool, fit, score test data
+    """
+    started = time.perf_counter()
+    pool = PoolCache(cache_dir).load(pool_key)
+    loaded = time.perf_counter()
+    model = model_class(**params)
+    model.fit(pool)
+    fitted = time.perf_counter()
+    result = {
+        'run': number,
+        **params,
+        'load_seconds': loaded - started,
+        'fit_seconds': fitted - loaded,
+        'trees': model.tree_count_,
+    }
+    if test is not None:
+        scores = model.predict(test.features_frame)
+        result['predict_seconds'] = time.perf_counter() - fitted
+        result.update(test.ranking_metrics(scores))
+    if save_path is not None:
+        model.save_model(save_path)
+    return result
+
+
+def run_sweep(
+        flow: AbstractTrainFlow,
+        train: PreparedResult,
+        grid: list[dict],
+        test: PreparedResult | None = None,
+        model_class: type = CatBoostRanker,
+        base_params: dict | None = None,
+        workers: int | None = None,
+        save_dir: str | Path | None = None,
+        quantization: dict | None = None,
+) -> pd.DataFrame:
+    """
+    fit a model for every grid point in parallel processes on learn pools of the flow
+
+    Every run takes the pool of its loss_function (flow.learn_pool_params: pairs pools for pairwise losses,
+    label pools for the others), each distinct pool is quantized once (flow.pool_cache or pool_cache directory)
+    and loaded by its runs; runs get pinned thread_count so that concurrent ones share the cores
+    without oversubscription.
+
+    :param grid: model params of runs (param_grid), loss_function may be one of them
+    :param test: data to compute post-processing metrics of every run on
+    :param base_params: params common to all runs
+    :param workers: concurrent runs, all cores by one thread for each run by default
+    :param save_dir: directory to save models as {flow.model_name}_sweep_{run}
+    :return: one row per run: params, label column of its pool, timings, tree count and metrics on test
+    """
+    pool_cache = flow.pool_cache or PoolCache()
+    runs = []
+    pool_keys = {}
+    for number, params in enumerate(grid):
+        loss_function = {**(base_params or {}), **params}.get('loss_function')
+        pool_params = flow.learn_pool_params(loss_function)
+        pool_config = json.dumps(pool_params, sort_keys=True)
+        if pool_config not in pool_keys:
+            pool_keys[pool_config] = flow.cached_pool_key(train, pool_cache, loss_function, **(quantization or {}))
+        runs.append((number, params, pool_keys[pool_config], pool_params['label_column']))
+    logging.info('Sweep pools: %r', len(pool_keys))
+
+    workers, thread_count = split_threads(len(grid), workers)
+    logging.info('Sweep of %r runs: %r concurrent, %r threads each', len(grid), workers, thread_count)
+    if save_dir is not None:
+        Path(save_dir).mkdir(parents=True, exist_ok=True)
+    started = time.perf_counter()
+    # spawn: catboost threads of the parent process do not survive fork
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        futures = [
+            executor.submit(
+                _fit_config,
+                number,
+                model_class,
+                {
+                    'verbose': False,
+                    **(base_params or {}),
+                    **params,
+                    'thread_count': thread_count,
+                },
+                str(pool_cache.cache_dir),
+                pool_key,
+                test,
+                None if save_dir is None else str(Path(save_dir) / f'{flow.model_name}_sweep_{number}'),
+            )
+            # the longest runs start first, so the sweep takes about as long as its longest run
+            for number, params, pool_key, _ in sorted(runs, key=lambda run: -run[1].get('iterations', 1000))
+        ]
+        results = sorted((future.result() for future in futures), key=lambda result: result['run'])
+    logging.info('Sweep done in %.1f s', time.perf_counter() - started)
+    table = pd.DataFrame(results)
+    table.insert(1, 'label_column', [label_column for _, _, _, label_column in runs])
+    return table